@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+"""Benchmarks MopidyClient against the synthetic Mopidy stand-in server and
+writes the results as one JSON object to stdout, so that the results of
+different releases can be compared."""
+
+import argparse
+import json
+import multiprocessing
+import os.path
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import fakemopidy
+from horsempdc.mpd.mopidy import MopidyClient
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50': samples[len(samples) / 2],
+        'p99': samples[min(len(samples) * 99 / 100, len(samples) - 1)],
+        'max': samples[-1],
+    }
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+
+def maxrss():
+    """Peak resident memory of this process in kilobytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def current_rss():
+    """Current resident memory of this process in kilobytes, if known."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024
+    except IOError:
+        return None
+
+
+def serve(args, ready):
+    server = fakemopidy.start(args.bands, args.albums, args.tracks,
+                              args.latency)
+    ready.put(server.host)
+    while True:
+        time.sleep(3600)
+
+
+def run(args, host):
+    results = {}
+
+    rss = maxrss()
+    start = time.time()
+    mpd = MopidyClient(host)
+    bands = mpd.bands()
+    results['startup'] = time.time() - start
+    results['bands_cold'] = results['startup']
+    results['bands_warm'] = timed(mpd.bands)
+
+    sample = bands[::max(len(bands) / args.samples, 1)][:args.samples]
+    results['albums'] = percentiles([timed(mpd.albums, band)
+                                     for band in sample])
+
+    mpd = MopidyClient(host)
+    mpd.bands()
+    results['albums_many'] = timed(mpd.albums_many, sample)
+
+    if args.crawl:
+        mpd = MopidyClient(host, pool_size=args.crawl)
+        results['crawl'] = timed(mpd.crawl, concurrency=args.crawl)
+
+    results['connections'] = mpd.jsonrpc.stats()
+    results['rss_kb'] = current_rss()
+    results['maxrss_kb'] = maxrss()
+    results['maxrss_delta_kb'] = results['maxrss_kb'] - rss
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bands', type=int, default=1000, help='Amount of bands.')
+    parser.add_argument('--albums', type=int, default=5, help='Amount of albums per band.')
+    parser.add_argument('--tracks', type=int, default=10, help='Amount of tracks per album.')
+    parser.add_argument('--latency', type=float, default=0, help='Latency in seconds added to each request.')
+    parser.add_argument('--samples', type=int, default=50, help='Amount of bands to time albums() for.')
+    parser.add_argument('--crawl', type=int, default=0, metavar='N', help='Also time a full crawl with N concurrent requests.')
+    parser.add_argument('--host', type=str, default=None, help='Benchmark an already running server instead.')
+    args = parser.parse_args()
+
+    # The server runs in its own process so that it doesn't compete with
+    # the client for the interpreter lock.
+    process = None
+    host = args.host
+    if not host:
+        ready = multiprocessing.Queue()
+        process = multiprocessing.Process(target=serve, args=(args, ready))
+        process.daemon = True
+        process.start()
+        host = ready.get()
+
+    try:
+        results = run(args, host)
+    finally:
+        if process:
+            process.terminate()
+
+    results['parameters'] = {
+        'bands': args.bands,
+        'albums': args.albums,
+        'tracks': args.tracks,
+        'latency': args.latency,
+    }
+    results['python'] = platform.python_version()
+
+    json.dump(results, sys.stdout, sort_keys=True)
+    sys.stdout.write('\n')
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+"""Synthetic stand-in for the Mopidy JsonRPC API, serving a generated
+library of a configurable size with a configurable latency."""
+
+import argparse
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+
+
+class Library(object):
+    def __init__(self, bands, albums, tracks):
+        self.bands = bands
+        self.albums = albums
+        self.tracks = tracks
+
+    def browse(self, uri):
+        if uri == 'local:directory':
+            return [self._ref('Band %d' % band,
+                              'local:directory?band=%d' % band)
+                    for band in xrange(self.bands)]
+
+        params = dict(part.split('=') for part in uri.split('?')[1].split('&'))
+        band = int(params['band'])
+
+        if 'album' not in params:
+            return [self._ref('Album %d' % album,
+                              '%s&album=%d' % (uri, album))
+                    for album in xrange(self.albums)]
+
+        return [self._ref('Track %d' % track,
+                          'local:track:%d:%s:%d' % (band, params['album'],
+                                                    track), 'track')
+                for track in xrange(self.tracks)]
+
+    def lookup(self, uris):
+        ret = {}
+        for uri in uris:
+            _, _, band, album, track = uri.split(':')
+            ret[uri] = [{
+                'uri': uri,
+                'name': 'Track %s' % track,
+                'track_no': int(track) + 1,
+                'length': 180000 + int(track) * 1000,
+                'album': {'name': 'Album %s' % album},
+                'artists': [{'name': 'Band %s' % band}],
+            }]
+        return ret
+
+    def _ref(self, name, uri, type_='directory'):
+        return {'__model__': 'Ref', 'name': name, 'uri': uri, 'type': type_}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Send the headers and the body of a response in one go. Separate
+    # writes make the client wait for a delayed acknowledgement.
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def _call(self, call):
+        library = self.server.library
+        try:
+            if call['method'] == 'core.library.browse':
+                result = library.browse(call['params']['uri'])
+            elif call['method'] == 'core.library.lookup':
+                result = library.lookup(call['params']['uris'])
+            elif call['method'] == 'core.tracklist.get_tracks':
+                result = []
+            else:
+                return {
+                    'jsonrpc': '2.0', 'id': call.get('id'),
+                    'error': {'code': -32601, 'message': 'Method not found'},
+                }
+        except (KeyError, IndexError, ValueError) as e:
+            return {
+                'jsonrpc': '2.0', 'id': call.get('id'),
+                'error': {'code': -32602, 'message': str(e)},
+            }
+
+        return {'jsonrpc': '2.0', 'id': call.get('id'), 'result': result}
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length'))
+        request = json.loads(self.rfile.read(length))
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if isinstance(request, list):
+            response = [self._call(call) for call in request]
+        else:
+            response = self._call(request)
+
+        data = json.dumps(response)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+        self.server.requests += 1
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, library, latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.library = library
+        self.latency = latency
+        self.requests = 0
+
+    @property
+    def host(self):
+        return '%s:%d' % self.server_address
+
+
+def start(bands, albums, tracks, latency=0, port=0):
+    """Starts a server in a background thread and returns it."""
+    server = Server(('127.0.0.1', port), Library(bands, albums, tracks),
+                    latency)
+
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=6680, help='Port to listen on.')
+    parser.add_argument('--bands', type=int, default=1000, help='Amount of bands.')
+    parser.add_argument('--albums', type=int, default=5, help='Amount of albums per band.')
+    parser.add_argument('--tracks', type=int, default=10, help='Amount of tracks per album.')
+    parser.add_argument('--latency', type=float, default=0, help='Latency in seconds added to each request.')
+    args = parser.parse_args()
+
+    server = Server(('127.0.0.1', args.port),
+                    Library(args.bands, args.albums, args.tracks),
+                    args.latency)
+    print('Serving on %s' % server.host)
+    server.serve_forever()
@@ -0,0 +1,149 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+"""Stand-in MPD daemon for testing horsempdc.mpd.native, which speaks just
+enough of the protocol to serve a small library: command lists, ACK
+responses, and list and find by album artist, album and file."""
+
+import shlex
+import SocketServer
+import threading
+
+
+class Ack(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+class Library(object):
+    def __init__(self, tracks):
+        # List of (file, band, album, title, track number) of each track.
+        self.tracks = tracks
+
+    def _match(self, args):
+        if len(args) % 2:
+            raise Ack(2, 'Incorrect number of arguments')
+
+        tags = {'albumartist': 1, 'album': 2, 'file': 0}
+        filters = []
+        for idx in xrange(0, len(args), 2):
+            if args[idx].lower() not in tags:
+                raise Ack(2, 'Unknown tag type: %s' % args[idx])
+            filters.append((tags[args[idx].lower()], args[idx + 1]))
+
+        return [track for track in self.tracks
+                if all(track[idx] == value for idx, value in filters)]
+
+    def list(self, args):
+        if not args or args[0].lower() not in ('albumartist', 'album'):
+            raise Ack(2, 'Unknown tag type')
+
+        key = 'AlbumArtist' if args[0].lower() == 'albumartist' else 'Album'
+        idx = 1 if key == 'AlbumArtist' else 2
+
+        seen, ret = set(), []
+        for track in self._match(args[1:]):
+            if track[idx] not in seen:
+                seen.add(track[idx])
+                ret.append((key, track[idx]))
+        return ret
+
+    def find(self, args):
+        ret = []
+        for uri, band, album, title, track_no in self._match(args):
+            ret.append(('file', uri))
+            if title is not None:
+                ret.append(('Title', title))
+            ret.append(('Track', '%d/99' % track_no))
+            ret.append(('Time', '%d' % (180 + track_no)))
+        return ret
+
+
+class Handler(SocketServer.StreamRequestHandler):
+    def _execute(self, line):
+        args = shlex.split(line)
+        command = getattr(self.server.library, args[0], None)
+        if args[0] not in ('list', 'find') or command is None:
+            raise Ack(5, 'unknown command "%s"' % args[0])
+        return command(args[1:])
+
+    def _response(self, commands, ok):
+        ret = []
+        for idx, line in enumerate(commands):
+            name = line.split(' ', 1)[0]
+            try:
+                pairs = self._execute(line)
+            except Ack as e:
+                ret.append('ACK [%d@%d] {%s} %s' % (e.code, idx, name, e))
+                return ret
+
+            ret.extend('%s: %s' % pair for pair in pairs)
+            if ok:
+                ret.append('list_OK')
+
+        ret.append('OK')
+        return ret
+
+    def handle(self):
+        self.wfile.write('OK MPD 0.19.0\n')
+
+        commands = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            line = line.rstrip('\n')
+            self.server.received.append(line)
+
+            if line == 'command_list_ok_begin':
+                commands = []
+                continue
+
+            if commands is not None and line != 'command_list_end':
+                commands.append(line)
+                continue
+
+            # Connections are dropped after receiving a command, as if the
+            # daemon had been restarted.
+            if self.server.drop:
+                self.server.drop -= 1
+                return
+
+            if commands is not None:
+                response = self._response(commands, True)
+                commands = None
+            else:
+                response = self._response([line], False)
+
+            self.wfile.write(''.join('%s\n' % row for row in response))
+            self.wfile.flush()
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, library):
+        SocketServer.TCPServer.__init__(self, address, Handler)
+        self.library = library
+
+        # Amount of connections to drop, and every line received.
+        self.drop = 0
+        self.received = []
+
+    @property
+    def host(self):
+        return '%s:%d' % self.server_address
+
+
+def start(tracks):
+    """Starts a server in a background thread and returns it."""
+    server = Server(('127.0.0.1', 0), Library(tracks))
+
+    t = threading.Thread(target=server.serve_forever, args=(0.05,))
+    t.daemon = True
+    t.start()
+    return server
@@ -0,0 +1,148 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+"""Stand-in WebSocket server for testing horsempdc.websocket. After the
+handshake each connection is handed over to whoever drives the test, which
+sends and receives the individual frames."""
+
+import base64
+import hashlib
+import Queue
+import SocketServer
+import struct
+import threading
+
+from horsempdc.websocket import OP_CONTINUATION, OP_TEXT, _GUID
+
+
+class Connection(object):
+    def __init__(self, rfile, wfile, path, headers):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.path = path
+        self.headers = headers
+
+        # Set once the test is done with this connection.
+        self.done = threading.Event()
+
+    def send_frame(self, opcode, payload, fin=True):
+        # Frames sent by a server are never masked.
+        header = chr((0x80 if fin else 0) | opcode)
+        if len(payload) < 126:
+            header += chr(len(payload))
+        elif len(payload) < 0x10000:
+            header += chr(126) + struct.pack('!H', len(payload))
+        else:
+            header += chr(127) + struct.pack('!Q', len(payload))
+
+        self.wfile.write(header + payload)
+        self.wfile.flush()
+
+    def send(self, text, fragments=1):
+        """Sends a text message, split up into the given amount of
+        frames."""
+        size = -(-len(text) // fragments)
+        for idx in xrange(fragments):
+            opcode = OP_TEXT if idx == 0 else OP_CONTINUATION
+            self.send_frame(opcode, text[idx * size:(idx + 1) * size],
+                            fin=idx == fragments - 1)
+
+    def _read(self, length):
+        data = self.rfile.read(length)
+        if len(data) != length:
+            raise EOFError
+        return data
+
+    def recv_frame(self):
+        """Returns the fin bit, opcode, unmasked payload, and whether the
+        frame was masked, of the next frame sent by the client."""
+        first, second = bytearray(self._read(2))
+
+        length = second & 0x7f
+        if length == 126:
+            length, = struct.unpack('!H', self._read(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', self._read(8))
+
+        mask = bytearray(self._read(4)) if second & 0x80 else None
+        data = bytearray(self._read(length))
+        if mask:
+            for idx in xrange(len(data)):
+                data[idx] ^= mask[idx % 4]
+
+        return bool(first & 0x80), first & 0x0f, str(data), bool(mask)
+
+    def close(self):
+        self.done.set()
+
+
+class Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        request = self.rfile.readline().split()
+        headers = {}
+        while True:
+            line = self.rfile.readline().strip()
+            if not line:
+                break
+
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if self.server.status != 101:
+            self.wfile.write('HTTP/1.1 %d Nope\r\n\r\n' % self.server.status)
+            return
+
+        key = headers.get('sec-websocket-key', '')
+        accept = base64.b64encode(hashlib.sha1(key + _GUID).digest())
+        if self.server.bad_accept:
+            accept = accept[::-1]
+
+        self.wfile.write('\r\n'.join([
+            'HTTP/1.1 101 Switching Protocols',
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            'Sec-WebSocket-Accept: %s' % accept,
+            '', '',
+        ]))
+        self.wfile.flush()
+
+        connection = Connection(self.rfile, self.wfile, request[1], headers)
+        self.server.connections.put(connection)
+
+        # The files are closed once this returns.
+        connection.done.wait()
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        SocketServer.TCPServer.__init__(self, address, Handler)
+
+        # Status of the handshake response, and whether to send a wrong
+        # Sec-WebSocket-Accept header.
+        self.status = 101
+        self.bad_accept = False
+
+        # Connections that completed the handshake.
+        self.connections = Queue.Queue()
+
+    @property
+    def url(self):
+        return 'ws://%s:%d/mopidy/ws' % self.server_address
+
+    def accept(self, timeout=5):
+        """Returns the next connection that completed the handshake."""
+        return self.connections.get(timeout=timeout)
+
+
+def start():
+    """Starts a server in a background thread and returns it."""
+    server = Server(('127.0.0.1', 0))
+
+    t = threading.Thread(target=server.serve_forever, args=(0.05,))
+    t.daemon = True
+    t.start()
+    return server
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+"""Replays key sequences through Curse.wait() against a fake curses screen
+and writes the time of each frame, the amount of calls to the curses API
+and the bytes that would be written to the terminal as one JSON object to
+stdout, for columns of various lengths."""
+
+import argparse
+import collections
+import curses
+import json
+import logging
+import os.path
+import platform
+import select
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from horsempdc.abstract import MPD
+from horsempdc.ebola import Curse
+from horsempdc.loop import EventLoop
+
+SCENARIOS = {
+    'scroll': 'j ' * 300 + 'k ' * 50,
+    'page': 'npage ' * 100 + 'ppage ' * 20,
+    'alt': 'alt 5 alt 0 alt q alt p ' * 25,
+    'columns': 'l h ' * 50,
+    'filter': '/ B a n d space 0 0 0 1 backspace backspace enter j j',
+    'enter': 'j enter h ' * 50 + 'k enter h ' * 50,
+}
+
+KEYS = {
+    'alt': 27,
+    'backspace': 127,
+    'enter': 10,
+    'space': 32,
+}
+
+
+def parse_keys(keys):
+    ret = []
+    for key in keys.split():
+        if key in KEYS:
+            ret.append(KEYS[key])
+        elif len(key) == 1:
+            ret.append(ord(key))
+        else:
+            ret.append(getattr(curses, 'KEY_%s' % key.upper()))
+    return ret
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50': samples[len(samples) / 2],
+        'p99': samples[min(len(samples) * 99 / 100, len(samples) - 1)],
+        'max': samples[-1],
+    }
+
+
+class FakeScreen(object):
+    """The virtual screen that windows are staged to and the physical
+    screen, i.e., what the terminal shows. Updating the screen writes the
+    cells that differ, which is roughly what ncurses does as well."""
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.virtual = [[(' ', 0)] * width for _ in xrange(height)]
+        self.physical = [[(' ', 0)] * width for _ in xrange(height)]
+        self.changed = set()
+
+        self.calls = collections.Counter()
+        self.bytes = 0
+        self.keys = collections.deque()
+
+    def doupdate(self):
+        self.calls['doupdate'] += 1
+
+        cursor, current = None, 0
+        for y in sorted(self.changed):
+            virtual, physical = self.virtual[y], self.physical[y]
+            for x in xrange(self.width):
+                if virtual[x] == physical[x]:
+                    continue
+
+                ch, attr = virtual[x]
+                if cursor != (y, x):
+                    self.bytes += len('\x1b[%d;%dH' % (y + 1, x + 1))
+                if attr != current:
+                    self.bytes += len('\x1b[0;%dm' % attr)
+                    current = attr
+
+                self.bytes += len(ch.encode('utf8'))
+                physical[x] = virtual[x]
+                cursor = y, x + 1
+
+        self.changed.clear()
+
+
+class FakeWindow(object):
+    def __init__(self, screen, rows, columns, y=0, x=0, pad=False):
+        self.screen = screen
+        self.rows = rows
+        self.columns = columns
+        self.y = y
+        self.x = x
+        self.pad = pad
+        self.cells = [[(' ', 0)] * columns for _ in xrange(rows)]
+
+        # Rows that changed since this window was last staged and the
+        # part of the pad that was staged last.
+        self.touched = set(xrange(rows))
+        self.viewport = None
+
+        self.cursor = 0, 0
+        self.delay = -1
+
+    def _call(self, name):
+        self.screen.calls[name] += 1
+
+    def _put(self, y, x, text, attr):
+        if isinstance(text, str):
+            text = text.decode('utf8', 'replace')
+
+        for ch in text:
+            if y >= self.rows:
+                raise curses.error('addstr() returned ERR')
+            self.cells[y][x] = ch, attr
+            self.touched.add(y)
+            x += 1
+            if x == self.columns:
+                y, x = y + 1, 0
+        self.cursor = y, x
+
+    def _check(self, y, x):
+        if y < 0 or y >= self.rows or x < 0 or x >= self.columns:
+            raise curses.error('position out of range')
+
+    def getmaxyx(self):
+        return self.rows, self.columns
+
+    def getbegyx(self):
+        return self.y, self.x
+
+    def addstr(self, y, x, text, attr=0):
+        self._call('addstr')
+        self._check(y, x)
+        self._put(y, x, text, attr)
+
+    def addch(self, y, x, ch, attr=0):
+        self._call('addch')
+        self._check(y, x)
+        if isinstance(ch, int):
+            ch = chr(ch & 0xff)
+        self._put(y, x, ch, attr)
+
+    def hline(self, y, x, ch, length):
+        self._call('hline')
+        self._check(y, x)
+        length = min(length, self.columns - x)
+        self.cells[y][x:x + length] = [(chr(ch & 0xff), 0)] * length
+        self.touched.add(y)
+
+    def chgat(self, y, x, length, attr):
+        self._call('chgat')
+        self._check(y, x)
+        row = self.cells[y]
+        for idx in xrange(x, min(x + length, self.columns)):
+            row[idx] = row[idx][0], attr
+        self.touched.add(y)
+
+    def move(self, y, x):
+        self._check(y, x)
+        self.cursor = y, x
+
+    def clrtoeol(self):
+        self._call('clrtoeol')
+        y, x = self.cursor
+        self.cells[y][x:] = [(' ', 0)] * (self.columns - x)
+        self.touched.add(y)
+
+    def erase(self):
+        self._call('erase')
+        self.cells = [[(' ', 0)] * self.columns for _ in xrange(self.rows)]
+        self.touched = set(xrange(self.rows))
+
+    def touchwin(self):
+        self.touched = set(xrange(self.rows))
+
+    def mvwin(self, y, x):
+        if y < 0 or x < 0 or y + self.rows > self.screen.height or \
+                x + self.columns > self.screen.width:
+            raise curses.error('mvwin() returned ERR')
+        self.y, self.x = y, x
+
+    def noutrefresh(self, *args):
+        self._call('noutrefresh')
+
+        if self.pad:
+            top, left, y, x, bottom, right = args
+        else:
+            top, left, y, x = 0, 0, self.y, self.x
+            bottom = y + self.rows - 1
+            right = x + self.columns - 1
+
+        bottom = min(bottom, self.screen.height - 1, y + self.rows - top - 1)
+        right = min(right, self.screen.width - 1, x + self.columns - left - 1)
+
+        # Showing another part of a pad changes every row on the screen.
+        if self.pad and self.viewport != args:
+            self.touched = set(xrange(self.rows))
+            self.viewport = args
+
+        for row in xrange(y, bottom + 1):
+            if top + row - y not in self.touched:
+                continue
+
+            cells = self.cells[top + row - y]
+            self.screen.virtual[row][x:right + 1] = cells[left:left + right - x + 1]
+            self.screen.changed.add(row)
+
+        self.touched = set()
+
+    def refresh(self, *args):
+        self.noutrefresh(*args)
+        self.screen.doupdate()
+
+    def keypad(self, flag):
+        pass
+
+    def nodelay(self, flag):
+        self.delay = -1 if flag else None
+
+    def timeout(self, delay):
+        self.delay = delay
+
+    def getch(self):
+        if self.screen.keys:
+            return self.screen.keys.popleft()
+        return -1
+
+
+def install(screen):
+    """Replaces the parts of the curses module that are used by HorseMPDC
+    with ones that draw to the fake screen."""
+    def ignore(*args):
+        pass
+
+    def newwin(rows, columns, y=0, x=0):
+        screen.calls['newwin'] += 1
+        return FakeWindow(screen, rows, columns, y, x)
+
+    def newpad(rows, columns):
+        screen.calls['newpad'] += 1
+        return FakeWindow(screen, rows, columns, pad=True)
+
+    def keyname(ch):
+        if 32 <= ch < 127:
+            return chr(ch)
+        return '^%s' % chr(ch + 64) if ch < 32 else str(ch)
+
+    stdscr = FakeWindow(screen, screen.height, screen.width)
+
+    curses.initscr = lambda: stdscr
+    curses.newwin = newwin
+    curses.newpad = newpad
+    curses.doupdate = screen.doupdate
+    curses.keyname = keyname
+
+    for name in ('start_color', 'use_default_colors', 'noecho', 'echo',
+                 'cbreak', 'nocbreak', 'curs_set', 'endwin'):
+        setattr(curses, name, ignore)
+
+    # These are normally only available after initscr().
+    curses.ACS_HLINE = ord('-')
+    curses.ACS_VLINE = ord('|')
+    curses.ACS_PLUS = ord('+')
+    curses.ACS_BTEE = ord('+')
+
+
+class ReplayLoop(EventLoop):
+    """Event loop which, rather than waiting for stdin, makes the next key
+    of the sequence available each time. Timers are run once they're due,
+    although a replay is normally over before that."""
+
+    def __init__(self, screen, keys):
+        EventLoop.__init__(self, None)
+        self.screen = screen
+        self.remaining = collections.deque(keys)
+
+    def idle(self):
+        """Runs timers and callbacks of other threads, but no keys."""
+        readable, _, _ = select.select([self.wakeup_r], [], [],
+                                       self._timeout())
+        if readable:
+            self._run_pending()
+        self._run_timers()
+
+    def run_once(self):
+        self._run_timers()
+        if not self.remaining:
+            return False
+
+        # The key following escape arrives along with it.
+        self.screen.keys.append(self.remaining.popleft())
+        if self.screen.keys[-1] == 27 and self.remaining:
+            self.screen.keys.append(self.remaining.popleft())
+        return True
+
+
+class FakeMPD(MPD):
+    def __init__(self, entries, albums=12):
+        MPD.__init__(self, 'render')
+        self.lines = [u'Band %07d' % idx for idx in xrange(entries)]
+        self.albums_per_band = albums
+
+    def _fetch_bands(self):
+        for name in self.lines:
+            yield name, name
+
+    def bands(self):
+        # The bands are generated in order already.
+        for _ in self.fetch_bands():
+            pass
+        return self.lines
+
+    def albums(self, band):
+        if band not in self._albums:
+            self._set_albums(band, [(u'Album %02d' % idx, band)
+                                    for idx in xrange(self.albums_per_band)])
+        return self._albums_ordered(band)
+
+
+def replay(args, entries, keys):
+    screen = FakeScreen(args.height, args.width)
+    install(screen)
+
+    mpd = FakeMPD(entries)
+    start = time.time()
+    curse = Curse(['bands', 'help'], 1, mpd)
+    curse.loop = ReplayLoop(screen, keys)
+    curse.redraw()
+    curse.update()
+    results = {'first_paint': time.time() - start}
+
+    # The keys are only replayed once all bands have been loaded.
+    curse.load_bands()
+    while curse.loading is not None:
+        curse.loop.idle()
+        curse.update()
+
+    results['setup'] = time.time() - start
+    results['setup_bytes'] = screen.bytes
+
+    screen.calls.clear()
+    screen.bytes = 0
+
+    frames = []
+    while curse.loop.remaining:
+        start = time.time()
+        curse.wait()
+        frames.append(time.time() - start)
+
+    # The last key is only drawn by the next call to wait().
+    start = time.time()
+    curse.update()
+    frames.append(time.time() - start)
+
+    curse.prefetcher.pool.close()
+
+    results['frames'] = len(frames)
+    results['frame'] = percentiles(frames)
+    results['total'] = sum(frames)
+    results['calls'] = dict(screen.calls)
+    results['bytes'] = screen.bytes
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=str, default='1000,100000,1000000', help='Comma-separated lengths of the bands column.')
+    parser.add_argument('--scenario', type=str, action='append', choices=sorted(SCENARIOS), help='Key sequences to replay, all by default.')
+    parser.add_argument('--keys', type=str, help='Replay these space-separated keys instead, e.g., "j j npage enter".')
+    parser.add_argument('--width', type=int, default=120, help='Width of the fake terminal.')
+    parser.add_argument('--height', type=int, default=40, help='Height of the fake terminal.')
+    args = parser.parse_args()
+
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    if args.keys:
+        scenarios = {'keys': args.keys}
+    else:
+        scenarios = dict((name, SCENARIOS[name])
+                         for name in args.scenario or SCENARIOS)
+
+    results = {}
+    for entries in args.entries.split(','):
+        for name, keys in sorted(scenarios.items()):
+            results['%s/%s' % (name, entries)] = \
+                replay(args, int(entries), parse_keys(keys))
+
+    results['parameters'] = {
+        'width': args.width,
+        'height': args.height,
+    }
+    results['python'] = platform.python_version()
+
+    json.dump(results, sys.stdout, sort_keys=True)
+    sys.stdout.write('\n')
@@ -2,20 +2,52 @@
 # This file is part of HorseMPDC - http://www.horsempdc.org/.
 # See the file 'docs/LICENSE.txt' for copying permission.
 
+import contextlib
 import curses
 import locale
+import logging
+import os.path
+import re
+import time
 
+from horsempdc.config import CONFDIR, init_confdir
 from horsempdc.exceptions import AngryHorseException
+from horsempdc.library import Names, URIs
+from horsempdc.ordering import SortedViews, collate, collate_the
+from horsempdc.search import SearchIndex
+from horsempdc.snapshot import Snapshot
 
-locale.setlocale(locale.LC_ALL, '')
-LOCALE = locale.getpreferredencoding()
+# Encoding of the terminal, as determined by init_locale().
+LOCALE = 'utf8'
+
+log = logging.getLogger(__name__)
+
+
+def init_locale():
+    """Sets up the locale of the user, which is required for drawing and
+    for sorting names with anything but plain ASCII characters."""
+    global LOCALE
+    locale.setlocale(locale.LC_ALL, '')
+    LOCALE = locale.getpreferredencoding()
 
 
 class Column(object):
+    __slots__ = (
+        'name', 'window', 'parent', 'pad', 'gutter', 'dirty', 'focus',
+        'x', 'y', 'width', 'height', 'line_offset', 'index', 'offset',
+        'pad_top', 'pad_rows', 'highlighted', 'lines', 'length',
+        'all_lines', 'search',
+    )
+
     COLUMNS = {}
     HAS_ALT = False
     CHARSET = '1234567890qwertyuiop'
 
+    # Amount of lines rendered above and below the visible part of the
+    # column. Only this window is kept in the pad, so that the memory and
+    # the time it takes to render a column don't depend on its length.
+    MARGIN = 64
+
     def __init__(self, name=None):
         self.name = name
 
@@ -23,6 +55,16 @@ class Column(object):
         self.parent = None
         self.pad = None
 
+        # Window holding the alt- combination hotkeys, if any. It's kept
+        # apart from the main window so that updating the hotkeys never
+        # touches the area of the pads.
+        self.gutter = None
+
+        # Whether this column has changed since it was last staged for the
+        # next screen update, and whether it has the focus.
+        self.dirty = True
+        self.focus = False
+
         self.x = None
         self.y = None
         self.width = None
@@ -38,40 +80,176 @@ class Column(object):
         # List offset from what should be visible in the pad.
         self.offset = 0
 
+        # First line of the list that is rendered in the pad and the
+        # amount of lines that fit in the pad.
+        self.pad_top = 0
+        self.pad_rows = 0
+
+        # Whether the current item is highlighted.
+        self.highlighted = False
+
     def populate(self, lines):
         self.lines = lines
         self.length = len(lines)
 
-    def prepare(self):
+        # All lines, regardless of the filter, and the index used to
+        # filter them, which gets ready in the background.
+        self.all_lines = lines
+        self.search = SearchIndex(lines)
+        self.search.start()
+
+        self.reset()
+
+    def reset(self):
+        """Moves back to the top after the lines have been changed."""
+        self.index = self.offset = 0
+        self.dirty = True
+
+        if self.pad:
+            self.pad_top = None
+            self.prepare()
+            self.render()
+
+    def grow(self):
+        """Shows the lines that have been appended to the list of lines
+        since, e.g., while the list is still being received, without
+        moving away from the current line."""
+        self.search.start()
+        if self.lines is not self.all_lines:
+            return
+
+        self.length = len(self.lines)
+        self.dirty = True
+
+        if self.pad:
+            self.pad_top = None
+            self.prepare()
+            self.render()
+
+    def filter(self, query):
+        """Narrows the column down to the lines matching the query."""
+        indices = self.search.search(query)
+        if len(indices) == len(self.all_lines):
+            self.lines = self.all_lines
+        else:
+            self.lines = [self.all_lines[idx] for idx in indices]
+
+        self.length = len(self.lines)
+        self.reset()
+
+    def restore(self):
+        """Drops the filter, if any, once this column is shown again, and
+        keeps the current line within the lines, which may have changed in
+        the meantime."""
+        if self.lines is not self.all_lines:
+            self.lines = self.all_lines
+            self.length = len(self.lines)
+            self.reset()
+            return
+
+        self.length = len(self.lines)
+        self.index = max(min(self.index, self.length - 1), 0)
+        self.offset = min(self.offset, self.index)
+        self.dirty = True
+
         if self.pad:
+            self.pad_top = None
+            self.prepare()
+            self.render()
+
+    def prepare(self):
+        """Ensures the windows of this column fit its current location. A
+        column that is shown in the same place again, e.g., in another
+        Layout, keeps its windows and the lines rendered into them."""
+        self.dirty = True
+
+        if self.HAS_ALT:
+            size = min(self.height, len(self.CHARSET)), self.line_offset
+            if not self.gutter or self.gutter.getmaxyx() != size or \
+                    self.gutter.getbegyx() != (self.y, self.x):
+                self.gutter = curses.newwin(size[0], size[1], self.y, self.x)
+
+        rows = max(min(self.length, self.height + 2 * self.MARGIN), 1)
+        columns = self.width - self.line_offset - 1
+        if self.pad and self.pad.getmaxyx() == (rows, columns):
+            return
+
+        self.pad_rows = rows
+        self.pad = curses.newpad(self.pad_rows, columns)
+
+        self.pad_top = None
+        self.render()
+
+    def render(self):
+        """Renders the window of lines around the visible part of the list
+        into the pad, if the visible part is not already in there."""
+        visible = min(self.height, self.length)
+        if self.pad_top is not None and self.offset >= self.pad_top and \
+                self.offset + visible <= self.pad_top + self.pad_rows:
             return
 
-        self.pad = curses.newpad(
-            self.length, self.width - self.line_offset - 1
-        )
+        top = min(self.offset - self.MARGIN, self.length - self.pad_rows)
+        self.pad_top = max(top, 0)
 
-        for idx, line in enumerate(self.lines):
+        self.pad.erase()
+        lines = self.lines[self.pad_top:self.pad_top + self.pad_rows]
+        for idx, line in enumerate(lines):
             self.pad.addstr(idx, 0, line.encode(LOCALE))
 
+        if self.highlighted:
+            self.highlight()
+
     def highlight(self, enable=True):
+        self.highlighted = enable
+        self.dirty = True
+
+        # The current item may not be rendered yet, in which case it will
+        # be highlighted by render() later on.
+        row = self.index - self.pad_top
+        if row < 0 or row >= min(self.pad_rows, self.length):
+            return
+
         attr = curses.A_REVERSE if enable else 0
         length = len(self.lines[self.index])
-        self.pad.chgat(self.index, 0, length, attr)
+        self.pad.chgat(row, 0, length, attr)
 
     def refresh(self):
-        self.pad.refresh(self.offset, 0,
-                         self.y, self.x + self.line_offset,
-                         self.y + self.height - 1,
-                         self.x + self.width - 1)
+        """Stages this column for the next screen update."""
+        self.render()
 
-    def draw(self, focus=True):
-        if self.HAS_ALT:
+        if self.gutter:
             # Alt- combination hotkeys.
-            attr = curses.A_REVERSE if focus else 0
-            for idx, ch in enumerate(self.CHARSET):
-                self.window.addch(self.y + idx, self.x, ch, attr)
+            attr = curses.A_REVERSE if self.focus else 0
+            height, _ = self.gutter.getmaxyx()
+            for idx, ch in enumerate(self.CHARSET[:height]):
+                self.gutter.addch(idx, 0, ch, attr)
+            self.gutter.noutrefresh()
+
+        self.pad.noutrefresh(self.offset - self.pad_top, 0,
+                             self.y, self.x + self.line_offset,
+                             self.y + self.height - 1,
+                             self.x + self.width - 1)
+        self.dirty = False
+
+    def draw(self, focus=True):
+        self.focus = focus
+        self.dirty = True
+
+    def shows(self, lines):
+        """Whether this column was created for this list of lines."""
+        return self.all_lines is lines
+
+    def select(self, index):
+        """Moves to a line, showing it at the top of the page if possible."""
+        highlighted = self.highlighted
+        self.highlight(False)
+
+        self.index = index
+        self.offset = max(min(index, self.length - self.height), 0)
 
-        self.refresh()
+        if highlighted:
+            self.highlight(True)
+        self.dirty = True
 
     def handle_alt(self, key):
         # If we're not handling this alt-key combination then we pass it
@@ -85,6 +263,9 @@ class Column(object):
         raise AngryHorseException('This column does not support enter.')
 
     def scroll(self, difference):
+        if not self.length:
+            raise AngryHorseException('Empty list!')
+
         # Top of the list.
         if self.index + difference < 0:
             if difference == -1:
@@ -126,28 +307,321 @@ class Column(object):
                 self.offset >= self.length - self.height:
             self.offset = self.length - self.height
 
-        self.refresh()
+        self.dirty = True
 
 
 class MPD(object):
+    BAND_ORDERS = 'alphabetical', 'the', 'played', 'albums'
+    ALBUM_ORDERS = 'alphabetical', 'the'
+
+    # Seconds after which the bands are fetched once more, if ever.
+    BANDS_TTL = None
+
     def __init__(self, host):
         self.host = host
+
+        # Names are interned and URIs are packed, see horsempdc.library.
+        # Bands map to the URI of each band, albums to a dict of the URI
+        # of each album of a band, and tracks to a tuple of the names and
+        # a tuple of the URIs of the tracks of an album.
+        self._names = Names()
+        self._uris = URIs()
         self._bands = {}
         self._albums = {}
+        self._tracks = {}
+
+        # Track number and length in seconds of the tracks of each album
+        # by their packed URI, as far as they have been looked up.
+        self._details = {}
+
+        # When each band was last played.
+        self._played = {}
+
+        # Sorted views of the bands and of the albums of each band.
+        self.band_order = 'alphabetical'
+        self.album_order = 'alphabetical'
+        self._set_bands({})
+
+        # When the bands expire, if ever.
+        self._bands_expire = None
+
+        # Callbacks for each event pushed by the daemon.
+        self._listeners = {}
+
+        # On-disk snapshot of the library, if any, and the index of each
+        # band in it so that its albums can be looked up lazily.
+        self.snapshot = None
+        self._snapshot_index = {}
+
+    def on(self, event, callback):
+        """Registers a callback for an event. Callbacks are invoked from
+        the thread that receives the events."""
+        self._listeners.setdefault(event, []).append(callback)
+
+    def emit(self, event, data):
+        for callback in self._listeners.get(event, []):
+            try:
+                callback(data)
+            except Exception:
+                log.exception('Error handling event %r', event)
+
+    @contextlib.contextmanager
+    def interactive(self):
+        """Calls made by this thread within this context are made on
+        behalf of the user, who is waiting for them."""
+        yield
+
+    @property
+    def snapshot_path(self):
+        host = re.sub('[^a-zA-Z0-9.-]', '_', self.host)
+        return os.path.join(CONFDIR, 'library-%s.snapshot' % host)
+
+    def load_snapshot(self):
+        """Loads the bands from the on-disk snapshot, if available. The
+        albums of each band are only read once they're requested."""
+        self.snapshot = Snapshot.load(self.snapshot_path)
+        if not self.snapshot:
+            return False
+
+        for idx, name, uri in self.snapshot.bands():
+            self._add_band(name, uri)
+            self._snapshot_index[name] = idx
+        return True
+
+    def save_snapshot(self):
+        albums = {}
+        for band in self._bands:
+            rows = self._snapshot_albums(band)
+            if rows is not None:
+                albums[band] = rows
+
+        bands = [(band, self.band_uri(band)) for band in self._bands]
+        init_confdir()
+        Snapshot.write(self.snapshot_path, bands, albums)
+
+    def _snapshot_albums(self, band):
+        """Returns the albums of a band as a list of (name, uri), either
+        from memory or from the snapshot, or None if they're unknown."""
+        albums = self._albums.get(band)
+        if albums is not None:
+            return [(name, self._uris.unpack(uri))
+                    for name, uri in albums.items()]
+
+        if self.snapshot and band in self._snapshot_index:
+            return self.snapshot.albums(self._snapshot_index[band])
+
+    def _band_orders(self):
+        return {
+            'alphabetical': collate,
+            'the': collate_the,
+            'played': lambda name: (-self._played.get(name, 0),
+                                    collate(name)),
+            'albums': lambda name: (-len(self._albums.get(name, ())),
+                                    collate(name)),
+        }
+
+    def _album_orders(self):
+        return {
+            'alphabetical': collate,
+            'the': collate_the,
+        }
+
+    def _set_bands(self, bands):
+        """Replaces all bands, e.g., after revalidating the library, by a
+        dict of the interned names and packed URIs of the bands."""
+        self._bands = bands
+        self._band_views = SortedViews(self._band_orders(), self._bands)
+        self._album_views = {}
+
+    def _pack(self, rows):
+        """Returns a dict of the interned names and packed URIs of a
+        list of (name, uri)."""
+        return dict((self._names(name), self._uris.pack(uri))
+                    for name, uri in rows)
+
+    def band_uri(self, band):
+        # The band may have been removed since it was shown, e.g., once
+        # the library has been revalidated.
+        try:
+            return self._uris.unpack(self._bands[band])
+        except KeyError:
+            raise AngryHorseException('Unknown band: %s.' % band)
+
+    def album_uri(self, band, album):
+        return self._uris.unpack(self._albums[band][album])
+
+    def _add_band(self, name, uri):
+        name, uri = self._names(name), self._uris.pack(uri)
+        if name not in self._bands:
+            self._bands[name] = uri
+            self._band_views.add(name)
+        else:
+            self._bands[name] = uri
+
+    def _set_albums(self, band, rows):
+        """Replaces the albums of a band by a list of (name, uri)."""
+        self._albums[band] = self._pack(rows)
+        self._album_views.pop(band, None)
+        if band in self._bands:
+            self._band_views.update(band, 'albums')
+
+    def _add_album(self, band, name, uri):
+        name, uri = self._names(name), self._uris.pack(uri)
+        albums = self._albums.get(band, {})
+        new = name not in albums
+        albums[name] = uri
+
+        # Stored once more so that a cache accounts for the new album.
+        self._albums[band] = albums
+        if not new:
+            return
+
+        if band in self._album_views:
+            self._album_views[band].add(name)
+        if band in self._bands:
+            self._band_views.update(band, 'albums')
+
+    def played(self, band):
+        """Marks a band as played just now."""
+        self._played[band] = time.time()
+        self._band_views.update(band, 'played')
 
     def _bands_ordered(self):
         """List of bands ordered as requested - by default alphabetically."""
-        return sorted(self._bands.keys())
+        return self._band_views.ordered(self.band_order)
 
     def _albums_ordered(self, band):
         """List of albums of a band ordered as requested - by default
         alphabetically."""
-        return sorted(self._albums[band].keys())
+        if band not in self._album_views:
+            self._album_views[band] = SortedViews(
+                self._album_orders(), self._albums[band])
+        return self._album_views[band].ordered(self.album_order)
+
+    def _set_tracks(self, band, album, rows):
+        """Sets the tracks of an album given a list of (name, uri) in the
+        order of the album. Unlike other names, the names of tracks are not
+        interned, so that they're freed along with the tracks once these
+        are evicted from a cache."""
+        names = tuple(name for name, _ in rows)
+        uris = tuple(self._uris.pack(uri) for _, uri in rows)
+        self._tracks[band, album] = names, uris
+
+    def _tracks_ordered(self, band, album):
+        """Tracks of an album in the order of the album. The same tuple is
+        returned each time, so that a column showing it can be reused."""
+        return self._tracks[band, album][0]
+
+    def _set_details(self, band, album, details):
+        """Adds the details of tracks of an album given a dict of the
+        track number and length of each track by its URI."""
+        known = dict(self._details.get((band, album), {}))
+        for uri, value in details.items():
+            known[self._uris.pack(uri)] = value
+        self._details[band, album] = known
+
+    def track_details(self, band, album, start, end):
+        """Returns the track number and length of the tracks start up to
+        end of an album, looking up all of them that are unknown in one
+        go. Either one is None if the daemon doesn't know about it."""
+        if (band, album) not in self._tracks:
+            self.tracks(band, album)
+
+        uris = self._tracks[band, album][1][start:end]
+        known = self._details.get((band, album), {})
+        missing = [self._uris.unpack(uri) for uri in uris
+                   if uri not in known]
+        if missing:
+            self._set_details(band, album, self.lookup(missing))
+            known = self._details.get((band, album), {})
+
+        return [known.get(uri, (None, None)) for uri in uris]
+
+    def _fetch_bands(self):
+        """Yields the name and URI of each band as soon as it has been
+        received."""
+        raise NotImplementedError
+
+    def bands_stale(self):
+        """Whether the bands are known, but have expired."""
+        return bool(self._bands) and self._bands_expire is not None and \
+            time.time() >= self._bands_expire
+
+    def fetch_bands(self):
+        """Fetches all bands, unless they're known already and haven't
+        expired, and yields each band as soon as it has been received.
+        Bands that are known already are only replaced once all of them
+        have been fetched once more."""
+        if self._bands and not self.bands_stale():
+            return
+
+        refresh, bands = bool(self._bands), {}
+        try:
+            for name, uri in self._fetch_bands():
+                if refresh:
+                    bands[self._names(name)] = self._uris.pack(uri)
+                else:
+                    self._add_band(name, uri)
+                yield name
+        except Exception:
+            # Rather than taking part of the bands for the entire library,
+            # they're fetched once more next time.
+            if not refresh:
+                self._set_bands({})
+            raise
+
+        if refresh:
+            self._set_bands(bands)
+        # Without a TTL the bands don't expire, unless they're invalidated.
+        if self.BANDS_TTL is not None:
+            self._bands_expire = time.time() + self.BANDS_TTL
+        else:
+            self._bands_expire = None
+
+    def _albums_evicted(self, band):
+        self._album_views.pop(band, None)
+        if band in self._bands:
+            self._band_views.update(band, 'albums')
+
+    def invalidate(self, band=None):
+        """Drops cached results so that they're fetched once more when
+        they're requested next: the albums of a band, or everything,
+        including the bands and the snapshot."""
+        if band is not None:
+            self._snapshot_index.pop(band, None)
+            self._albums.pop(band, None)
+            self._albums_evicted(band)
+            return
+
+        self._bands_expire = 0
+        self.snapshot = None
+        self._snapshot_index = {}
+        self._albums.clear()
+        self._tracks.clear()
+        self._details.clear()
+        self._album_views = {}
 
     def bands(self):
         """Returns a sorted list of all available bands."""
-        raise NotImplementedError
+        for _ in self.fetch_bands():
+            pass
+
+        return self._bands_ordered()
 
     def albums(self, name):
         """Returns a sorted list of all albums for the specified band."""
         raise NotImplementedError
+
+    def albums_many(self, bands):
+        """Fetches the albums of multiple bands."""
+        for band in bands:
+            self.albums(band)
+
+    def tracks(self, band, album):
+        """Returns all tracks of the specified album in album order."""
+        raise NotImplementedError
+
+    def lookup(self, uris):
+        """Looks up the track number and length of multiple tracks and
+        returns them by URI."""
+        raise NotImplementedError
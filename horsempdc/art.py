@@ -2,6 +2,8 @@
 # This file is part of HorseMPDC - http://www.horsempdc.org/.
 # See the file 'docs/LICENSE.txt' for copying permission.
 
+import curses
+
 # Thanks to http://www.asciiworld.com/-Horses-.html
 
 _doge_horse = r"""
@@ -89,7 +91,14 @@ _angry_horse = r"""
 """
 
 
+_PARSED = {}
+_SPRITES = {}
+
+
 def load_ascii_art(name):
+    if name in _PARSED:
+        return _PARSED[name]
+
     inventory = {
         'doge-horse': _doge_horse,
         'dumb-horse': _dumb_horse,
@@ -104,4 +113,36 @@ def load_ascii_art(name):
 
     rows = len(lines)
     columns = max(len(line) for line in lines)
+    _PARSED[name] = rows, columns, lines
     return rows, columns, lines
+
+
+class Sprite(object):
+    """ASCII art that is parsed once and rendered into a window once per
+    width it is clipped to. Drawing a frame then only moves a window."""
+
+    def __init__(self, name):
+        self.rows, self.columns, self.lines = load_ascii_art(name)
+        self.windows = {}
+
+    def window(self, width, attr=0):
+        """Returns a window with the sprite clipped to the given width."""
+        width = min(width, self.columns)
+        if (width, attr) not in self.windows:
+            window = curses.newwin(self.rows, width, 0, 0)
+            for idx, line in enumerate(self.lines):
+                try:
+                    window.addstr(idx, 0, line[:width], attr)
+                except curses.error:
+                    # Writing the bottom-right character moves the cursor
+                    # beyond the window, which ncurses reports as an error.
+                    pass
+
+            self.windows[width, attr] = window
+        return self.windows[width, attr]
+
+
+def sprite(name):
+    if name not in _SPRITES:
+        _SPRITES[name] = Sprite(name)
+    return _SPRITES[name]
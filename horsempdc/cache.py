@@ -0,0 +1,178 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import collections
+import threading
+import time
+
+from horsempdc.metrics import metrics
+
+
+class Cache(object):
+    """Results bounded by a memory budget. Each entry has a size in bytes,
+    as estimated by whoever adds it, and once the total size exceeds the
+    budget the least recently used entries are evicted. Entries with a
+    time to live also expire once that has passed."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+
+        # The value, size and expiry time of each entry, least recently
+        # used first.
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        # Callbacks invoked with the key of each evicted or expired entry,
+        # by the first element of the key.
+        self.listeners = {}
+
+        # Keys of the entries that were found to have expired while looking
+        # them up. Lookups may happen while the caller holds a lock of its
+        # own, e.g., when sorting by the amount of albums of each band, so
+        # the listeners are only told about these on the next change.
+        self.expired = []
+
+    def _expired(self, entry):
+        return entry[2] is not None and entry[2] <= time.time()
+
+    def _evicted(self, keys):
+        # Callbacks are invoked without holding the lock, so that they can
+        # use the cache themselves.
+        with self.lock:
+            keys, self.expired = self.expired + keys, []
+
+        for key in keys:
+            callback = self.listeners.get(key[0])
+            if callback:
+                callback(key[1])
+
+    def contains(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+
+            if not self._expired(entry):
+                return True
+
+            del self.entries[key]
+            self.size -= entry[1]
+            self.expired.append(key)
+
+        metrics.count('cache expirations')
+        return False
+
+    def get(self, key, default=None, touch=True):
+        """Returns the value of an entry, which is then the most recently
+        used one unless touch is False."""
+        if not self.contains(key):
+            return default
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+
+            if touch:
+                del self.entries[key]
+                self.entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value, size, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+
+        evicted = []
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+            self.entries[key] = value, size, expires
+            self.size += size
+
+            # The entry that was just added is kept even if it exceeds
+            # the budget all by itself.
+            while self.size > self.budget and len(self.entries) > 1:
+                old, entry = self.entries.popitem(last=False)
+                self.size -= entry[1]
+                evicted.append(old)
+
+        if evicted:
+            metrics.count('cache evictions', len(evicted))
+        self._evicted(evicted)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+        self._evicted([])
+        return entry[0] if entry is not None else default
+
+    def keys(self, kind):
+        """Returns the keys, without their kind, of all entries of a kind
+        that haven't expired."""
+        with self.lock:
+            return [key[1] for key, entry in self.entries.items()
+                    if key[0] == kind and not self._expired(entry)]
+
+    def clear(self, kind):
+        with self.lock:
+            for key in self.entries.keys():
+                if key[0] == kind:
+                    self.size -= self.entries.pop(key)[1]
+
+        self._evicted([])
+
+    def view(self, kind, sizeof, ttl=None, on_evict=None):
+        if on_evict:
+            self.listeners[kind] = on_evict
+        return CacheView(self, kind, sizeof, ttl)
+
+
+class CacheView(object):
+    """The entries of one kind in a Cache, e.g., the albums of each band,
+    which share the budget with the other kinds. Behaves like a dict, with
+    one exception: only [] counts as using an entry, get() and "in" don't,
+    so that, e.g., sorting all bands by their amount of albums doesn't
+    make every band the most recently used one."""
+
+    def __init__(self, cache, kind, sizeof, ttl=None):
+        self.cache = cache
+        self.kind = kind
+        self.sizeof = sizeof
+        self.ttl = ttl
+
+    def __contains__(self, key):
+        return self.cache.contains((self.kind, key))
+
+    def __getitem__(self, key):
+        value = self.cache.get((self.kind, key), self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        return self.cache.get((self.kind, key), default, touch=False)
+
+    def __setitem__(self, key, value):
+        self.cache.set((self.kind, key), value, self.sizeof(value), self.ttl)
+
+    def pop(self, key, default=None):
+        return self.cache.pop((self.kind, key), default)
+
+    def __iter__(self):
+        return iter(self.cache.keys(self.kind))
+
+    def __len__(self):
+        return len(self.cache.keys(self.kind))
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def clear(self):
+        self.cache.clear(self.kind)
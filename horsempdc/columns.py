@@ -2,34 +2,175 @@
 # This file is part of HorseMPDC - http://www.horsempdc.org/.
 # See the file 'docs/LICENSE.txt' for copying permission.
 
+import logging
+import threading
+
 from horsempdc.abstract import Column
+from horsempdc.exceptions import AngryHorseException
+from horsempdc.search import SearchIndex
+
+log = logging.getLogger(__name__)
+
+
+def _duration(seconds):
+    if seconds is None:
+        return ''
+
+    minutes, seconds = divmod(seconds, 60)
+    if minutes >= 60:
+        return '%d:%02d:%02d' % (minutes / 60, minutes % 60, seconds)
+    return '%d:%02d' % (minutes, seconds)
+
+
+def _track_line(name, track_no=None, length=None):
+    return u'%3s %5s  %s' % (track_no or '', _duration(length), name)
 
 
 class BandsColumn(Column):
+    __slots__ = 'bands',
+
     HAS_ALT = True
-    name = 'bands'
 
     def __init__(self, bands):
-        Column.__init__(self)
+        Column.__init__(self, 'bands')
         self.populate(bands)
 
         self.bands = bands
 
+    def scroll(self, difference):
+        Column.scroll(self, difference)
+        self.parent.curse.prefetcher.prefetch(self.lines, self.index)
+
     def handle_enter(self):
-        albums = self.parent.curse.mpd.albums(self.lines[self.index])
+        if not self.lines:
+            raise AngryHorseException('No band selected.')
+
+        band = self.lines[self.index]
+        albums = self.parent.curse.prefetcher.albums(band)
 
+        # Opening a band is the closest thing to playing it for now.
+        self.parent.curse.mpd.played(band)
+
+        # The bands are shown in the same place, so this column and its pad
+        # are simply shown once more.
         columns = [
-            BandsColumn(self.bands),
-            AlbumsColumn(albums),
+            self,
+            self.parent.curse.column(('albums', band), albums,
+                                     lambda albums: AlbumsColumn(band, albums)),
         ]
 
         self.parent.curse.new_layout(2, columns)
 
 
 class AlbumsColumn(Column):
+    __slots__ = 'band',
+
     HAS_ALT = True
-    name = 'albums'
 
-    def __init__(self, albums):
-        Column.__init__(self)
+    def __init__(self, band, albums):
+        Column.__init__(self, 'albums')
         self.populate(albums)
+
+        self.band = band
+
+    def handle_enter(self):
+        if not self.lines:
+            raise AngryHorseException('No album selected.')
+
+        curse = self.parent.curse
+        band, album = self.band, self.lines[self.index]
+        tracks = curse.mpd.tracks(band, album)
+
+        column = curse.column(('tracks', band, album), tracks,
+                              lambda tracks: TracksColumn(band, album, tracks))
+        column.load(curse)
+
+        curse.new_layout(2, [self, column])
+
+
+class TracksColumn(Column):
+    """Lists the tracks of an album. Browsing an album only returns the
+    names of its tracks, so their track number and length are looked up
+    in the background, page by page, starting with the visible page."""
+
+    __slots__ = 'band', 'album', 'tracks', 'pages', 'loader'
+
+    HAS_ALT = True
+
+    # Amount of tracks that are looked up in one request.
+    PAGE_SIZE = 50
+
+    def __init__(self, band, album, tracks):
+        Column.__init__(self, 'tracks')
+        self.populate([_track_line(name) for name in tracks])
+
+        self.band = band
+        self.album = album
+        self.tracks = tracks
+
+        # Whether each page has been looked up, or is being looked up by
+        # the loader thread.
+        pages = (len(tracks) + self.PAGE_SIZE - 1) / self.PAGE_SIZE
+        self.pages = [False] * pages
+        self.loader = None
+
+    def shows(self, tracks):
+        return self.tracks is tracks
+
+    def load(self, curse):
+        """Looks up the pages that haven't been looked up yet."""
+        if all(self.pages) or self.loader and self.loader.is_alive():
+            return
+
+        def load():
+            while True:
+                page = self._next_page()
+                if page is None:
+                    return
+
+                start = page * self.PAGE_SIZE
+                try:
+                    details = curse.mpd.track_details(
+                        self.band, self.album, start, start + self.PAGE_SIZE)
+                except Exception:
+                    log.exception('Error looking up the tracks of %r',
+                                  self.album)
+
+                    # Looked up once more the next time the column is
+                    # loaded.
+                    self.pages[page] = False
+                    return
+
+                curse.loop.call_soon_threadsafe(self._loaded, start, details)
+
+        self.loader = threading.Thread(target=load)
+        self.loader.daemon = True
+        self.loader.start()
+
+    def _next_page(self):
+        """Returns the first page that hasn't been looked up, starting at
+        the visible page, as the user may have scrolled in the meantime."""
+        first = min(self.offset / self.PAGE_SIZE, len(self.pages))
+        for page in range(first, len(self.pages)) + range(first):
+            if not self.pages[page]:
+                self.pages[page] = True
+                return page
+
+    def _loaded(self, start, details):
+        for idx, (track_no, length) in enumerate(details, start):
+            self.all_lines[idx] = _track_line(self.tracks[idx], track_no,
+                                              length)
+
+        # A filtered list keeps showing the lines as they were when it
+        # was filtered.
+        self.search = SearchIndex(self.all_lines)
+        if self.lines is not self.all_lines:
+            return
+
+        # Render the pad once more if it holds any of the changed lines.
+        if self.pad and self.pad_top is not None and \
+                start < self.pad_top + self.pad_rows and \
+                start + len(details) > self.pad_top:
+            self.pad_top = None
+            self.render()
+            self.dirty = True
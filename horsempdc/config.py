@@ -4,7 +4,10 @@
 
 import os
 
-CONFDIR = os.path.join(os.getenv('HOME'), '.horsempdc')
+CONFDIR = os.path.join(os.path.expanduser('~'), '.horsempdc')
 
-if not os.path.isdir(CONFDIR):
-    os.mkdir(CONFDIR)
+
+def init_confdir():
+    """Creates the configuration directory, if it doesn't exist yet."""
+    if not os.path.isdir(CONFDIR):
+        os.mkdir(CONFDIR)
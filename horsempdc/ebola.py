@@ -2,48 +2,67 @@
 # This file is part of HorseMPDC - http://www.horsempdc.org/.
 # See the file 'docs/LICENSE.txt' for copying permission.
 
+import collections
 import curses
 import logging
+import sys
+import threading
 import time
 
-from horsempdc.abstract import Column
-from horsempdc.art import load_ascii_art
+from horsempdc.abstract import Column, init_locale
+from horsempdc.art import sprite
 from horsempdc.columns import BandsColumn
 from horsempdc.exceptions import AngryHorseException, TranquilizerException
 from horsempdc.exceptions import RemoveHorseHandler
+from horsempdc.jsonrpc import RPCException
+from horsempdc.loop import EventLoop
+from horsempdc.metrics import metrics
+from horsempdc.prefetch import AlbumPrefetcher
 
 log = logging.getLogger(__name__)
 
 
 class WalkingHorse(object):
+    # Frames per second, i.e., the maximum rate at which the horse moves.
+    FPS = 10
+    DELAY = 1.0 / FPS
+
+    # Vertical offset for each step of the gallop.
+    GALLOP = 0, 1, 2, 1, 0
+
     def __init__(self):
         self.index = 0
         self.window = None
         self.width = None
+        self.sprite = sprite('doge-horse')
+
+        # Window in which the horse is drawn on top of everything else.
+        self.overlay = None
 
     def gallop(self):
-        return [0, 1, 2, 1, 0][self.index % 5]
+        return self.GALLOP[self.index % len(self.GALLOP)]
 
     def draw(self):
-        rows, columns, lines = load_ascii_art('doge-horse')
-
         height, _ = self.window.getmaxyx()
 
         # End of the horse ride.
         if self.index >= self.width:
             raise RemoveHorseHandler
 
-        for idx, line in enumerate(lines):
-            self.window.addstr(height - rows - 2 + idx - self.gallop(),
-                               self.index, line[:self.width - self.index])
+        self.overlay = self.sprite.window(self.width - self.index)
+        self.overlay.mvwin(height - self.sprite.rows - 2 - self.gallop(),
+                           self.index)
 
         self.index += 2
 
-        self.window.refresh()
-        time.sleep(0.1)
-
 
 class Layout(object):
+    __slots__ = (
+        'curse', 'window', 'columns', 'lines', 'status_line', 'dirty',
+        'status_dirty', 'current', 'current_index', 'height', 'width',
+        'column_width',
+    )
+
     def __init__(self, curse, *columns):
         self.curse = curse
         self.window = curse.stdscr
@@ -52,6 +71,11 @@ class Layout(object):
         self.lines = []
         self.status_line = ''
 
+        # Whether the lines, column names and status line, i.e., everything
+        # that is drawn to the main window, have to be drawn again.
+        self.dirty = True
+        self.status_dirty = True
+
         self.current = None
         self.current_index = None
 
@@ -63,6 +87,21 @@ class Layout(object):
         line += ' ' * (self.width - len(line) - 1)
 
         self.status_line = line
+        self.status_dirty = True
+
+    def draw_status(self):
+        self.window.move(self.height - 1, 0)
+        self.window.clrtoeol()
+        self.window.addstr(self.height - 1, 0, self.status_line)
+
+        # Live metrics are shown on the right-hand side, if enabled.
+        line = self.curse.metrics_line
+        if line:
+            line = line[:self.width - 1]
+            self.window.addstr(self.height - 1, self.width - 1 - len(line),
+                               line)
+
+        self.status_dirty = False
 
     def active_column(self, index):
         if index >= 0 and index < len(self.columns):
@@ -74,7 +113,7 @@ class Layout(object):
 
     def resize(self):
         self.height, self.width = self.window.getmaxyx()
-        self.draw()
+        self.dirty = True
 
     def previous_column(self):
         self.current.highlight(enable=False)
@@ -91,6 +130,7 @@ class Layout(object):
         self.current.draw(focus=True)
 
     def draw(self):
+        start = time.time()
         self.column_width = self.width / len(self.columns)
 
         # Horizontal lines. One on top to distinguish the columns, one on the
@@ -133,36 +173,104 @@ class Layout(object):
         for column in self.columns:
             column.draw(self.current == column)
 
-        # Draw the status line.
-        self.window.addstr(self.height - 1, 0, self.status_line)
+        self.draw_status()
+        self.dirty = False
+
+        metrics.timing('ui draw', time.time() - start)
+
+    def update(self):
+        """Draws whatever changed and stages it for the next screen update.
+        The main window is staged first so that the columns end up on top
+        of it."""
+        if self.dirty:
+            self.draw()
+        elif self.status_dirty:
+            self.draw_status()
+
+        self.window.noutrefresh()
+
+        for column in self.columns:
+            if column.dirty:
+                column.refresh()
 
 
 class Curse(object):
+    # Seconds that a status message and an angry horse remain visible.
+    STATUS_TIMEOUT = 3
+    ANGRY_TIMEOUT = 0.2
+
+    # Seconds between metrics summaries in the log and between updates of
+    # the metrics on the status line.
+    METRICS_INTERVAL = 60
+    METRICS_LINE_INTERVAL = 1
+
+    # Seconds between updates of the bands column while it's loading.
+    LOADING_INTERVAL = 0.2
+
+    # Amount of Layout frames kept on the stack and of columns kept around
+    # to be shown again.
+    STACK_SIZE = 8
+    CACHE_SIZE = 32
+
     def __init__(self, layout, active_column, mpd):
         self._init_ncurses()
 
+        # Keys are read whenever stdin is readable and animations and other
+        # delayed events are run as timers in between.
+        self.loop = EventLoop(sys.stdin.fileno())
+        self._status_timer = None
+        self._angry_timer = None
+
+        # When the keys drawn by the next update were read, and the live
+        # metrics shown on the status line, if enabled.
+        self._key_time = None
+        self.metrics_line = None
+        self._metrics_timer = None
+        self.loop.call_later(self.METRICS_INTERVAL, self._log_metrics)
+
+        # Windows drawn on top of the layout, e.g., horses, and whether any
+        # of them moved, in which case whatever was below has to be staged
+        # again.
+        self.overlays = []
+        self._overlays_changed = False
+        self._horse_overlay = None
+
         self.columns = {
             'help': Column('help'),
             'playlist': Column('playlist'),
         }
 
         self.mpd = mpd
+        self.prefetcher = AlbumPrefetcher(mpd)
 
         self.columns['help'].populate(['foo', 'bar', 'help'])
         self.columns['playlist'].populate(['foo', 'bar', 'playlist'])
-        self.columns['bands'] = BandsColumn(mpd.bands())
 
-        # Callback function that can be used to handle non-blocking events,
-        # when .getch() returns "failure", i.e., no keys available.
-        self._nonblocking_handler = None
+        # The bands are filled in by load_bands(), so that the screen can
+        # be drawn before the library has been received. While loading,
+        # this is the list of bands received so far.
+        self.columns['bands'] = BandsColumn([])
+        self.loading = None
+
+        # Why the bands couldn't be loaded, if they couldn't.
+        self.bands_error = None
+
+        # Thread that loads the bands, once they're being loaded.
+        self.loader = None
+
+        # Query of the filter that is being typed, if any.
+        self.filter_query = None
 
         columns = []
         for column in layout:
             columns.append(self.columns[column])
 
-        # Stack containing each Layout frame.
+        # Stack containing the most recent Layout frames.
         self.stack = []
 
+        # Recently shown columns, least recently shown first.
+        self.column_cache = collections.OrderedDict()
+
         # Default layout.
         self.new_layout(active_column, columns)
 
@@ -173,13 +281,176 @@ class Curse(object):
         """Returns the most recent Layout frame."""
         return self.stack[-1]
 
+    def watch(self):
+        """Updates the columns whenever the daemon reports a change. Event
+        callbacks run in another thread, so any drawing is handed over to
+        the event loop."""
+        def tracklist_changed(data):
+            tracks = self.mpd.tracklist()
+            self.loop.call_soon_threadsafe(self._populate, 'playlist', tracks)
+
+        def playback_state_changed(data):
+            self.loop.call_soon_threadsafe(
+                self.status, 'Playback %s.', data.get('new_state'))
+
+        self.mpd.on('tracklist_changed', tracklist_changed)
+        self.mpd.on('playback_state_changed', playback_state_changed)
+
+    def load_bands(self, refresh=False):
+        """Fetches the bands in the background. Until all of them have
+        been received and sorted the bands column shows the bands received
+        so far, in the order in which they were received, or, when
+        refreshing the bands, the bands that were shown already."""
+        self.loading = []
+        self.bands_error = None
+        if not refresh:
+            self.columns['bands'].populate(self.loading)
+
+        def load():
+            try:
+                for band in self.mpd.fetch_bands():
+                    self.loading.append(band)
+                bands = self.mpd.bands()
+            except Exception as e:
+                log.exception('Error fetching the bands')
+                self.loop.call_soon_threadsafe(self._bands_failed, e, refresh)
+                return
+
+            self.loop.call_soon_threadsafe(self._bands_loaded, bands)
+
+        self.loader = threading.Thread(target=load)
+        self.loader.daemon = True
+        self.loader.start()
+
+        self._show_loading()
+
+    def revalidate(self):
+        """Brings the library as loaded from the snapshot up-to-date in
+        the background, once the bands have been loaded, and shows the
+        bands once more if any of them changed."""
+        loader = self.loader
+
+        def revalidate():
+            if loader:
+                loader.join()
+
+            try:
+                if not self.mpd.revalidate():
+                    return
+
+                self.mpd.save_snapshot()
+                bands = self.mpd.bands()
+            except RPCException as e:
+                log.info('Error revalidating the library: %s', e)
+                return
+
+            self.loop.call_soon_threadsafe(self._bands_loaded, bands)
+
+        t = threading.Thread(target=revalidate)
+        t.daemon = True
+        t.start()
+
+    def crawl(self, concurrency):
+        """Walks the entire library in the background, once the bands
+        have been loaded, so that it's cached up front."""
+        loader = self.loader
+
+        def crawl():
+            if loader:
+                loader.join()
+
+            try:
+                self.mpd.crawl(concurrency=concurrency)
+            except RPCException as e:
+                log.info('Error crawling the library: %s', e)
+                return
+
+            self.loop.call_soon_threadsafe(self.status, 'Crawled the library.')
+
+        t = threading.Thread(target=crawl)
+        t.daemon = True
+        t.start()
+
+    def _show_loading(self):
+        if self.loading is None:
+            return
+
+        if self.columns['bands'].shows(self.loading):
+            self.columns['bands'].grow()
+        if self.filter_query is None:
+            self.layout.status('Loading bands... %d', len(self.loading))
+
+        self.loop.call_later(self.LOADING_INTERVAL, self._show_loading)
+
+    def _bands_loaded(self, bands):
+        self.loading = None
+
+        # Stay at the band that was selected while loading, if any.
+        column = self.columns['bands']
+        current = column.lines[column.index] if column.index else None
+
+        column.populate(bands)
+        column.bands = bands
+
+        if current in column.lines:
+            column.select(column.lines.index(current))
+
+        self.status('Loaded %d bands.', len(bands))
+
+    def _bands_failed(self, e, refresh=False):
+        # Bands that couldn't be refreshed keep being shown and are
+        # refreshed once more later on.
+        self.loading = None
+        if refresh:
+            self.angry_horse('Error refreshing the bands: %s', e)
+            return
+
+        # The bands that were received before the error have been dropped
+        # as well, so they're no longer shown either. Reordering the bands
+        # loads them once more.
+        self.bands_error = e
+
+        column = self.columns['bands']
+        column.populate([])
+        column.bands = []
+
+        self.redraw()
+        self.angry_horse('Error fetching the bands: %s', e)
+
+    def _populate(self, name, lines):
+        self.columns[name].populate(lines)
+        if self.columns[name] in self.layout.columns:
+            self.redraw()
+
     def new_layout(self, active_column, columns):
         layout = Layout(self, *columns)
         layout.active_column(active_column - 1)
         self.stack.append(layout)
 
+        # The oldest frames are dropped along with any of their columns
+        # that are not shown or cached elsewhere.
+        del self.stack[:-self.STACK_SIZE]
+
+    def column(self, key, lines, factory):
+        """Returns the column that was created for key earlier if it still
+        shows the same list of lines, and otherwise a new one created by
+        factory(lines). A column that is reused keeps its rendered pad,
+        but not the filter it may have had."""
+        column = self.column_cache.pop(key, None)
+        if column is None or not column.shows(lines):
+            column = factory(lines)
+        else:
+            column.restore()
+
+        self.column_cache[key] = column
+        while len(self.column_cache) > self.CACHE_SIZE:
+            self.column_cache.popitem(last=False)
+        return column
+
     def _init_ncurses(self):
-        # Initialize ncurses and get the main window object.
+        # Initialize ncurses and get the main window object. It only draws
+        # anything but ASCII if the locale has been set up beforehand.
+        init_locale()
         self.stdscr = curses.initscr()
 
         # Enable colors.
@@ -198,6 +469,9 @@ class Curse(object):
         # Let ncurses interpret special keyboard keys.
         self.stdscr.keypad(1)
 
+        # Never block in .getch(), we only read keys once they're available.
+        self.stdscr.nodelay(1)
+
         # Disable the cursor.
         try:
             curses.curs_set(0)
@@ -212,6 +486,7 @@ class Curse(object):
             10: 'enter',
             21: 'ctrl_u',
             27: 'alt',
+            47: 'slash',
         }
 
         for key in dir(curses):
@@ -227,87 +502,196 @@ class Curse(object):
         curses.endwin()
 
     def install_horse_handler(self, horse):
-        self._nonblocking_handler = horse.draw
         horse.window = self.stdscr
-        self.stdscr.nodelay(1)
 
         # TODO Make this a bit more generic. We just don't want the horse to
         # pass by the Bands column.
         _, horse.width = self.stdscr.getmaxyx()
         horse.width = horse.width / 3 * 2
 
+        self.loop.call_later(0, self._horse_frame, horse)
+
+    def _horse_frame(self, horse):
+        try:
+            horse.draw()
+        except (RemoveHorseHandler, curses.error):
+            # The ride ends at the end of the road or when the terminal is
+            # too small for the horse.
+            self.remove_overlay(self._horse_overlay)
+            return
+
+        # The walking horse stays below any other overlay.
+        self.remove_overlay(self._horse_overlay)
+        self._horse_overlay = horse.overlay
+        self.add_overlay(horse.overlay, bottom=True)
+
+        self.loop.call_later(horse.DELAY, self._horse_frame, horse)
+
+    def add_overlay(self, window, bottom=False):
+        self.overlays.insert(0 if bottom else len(self.overlays), window)
+        self._overlays_changed = True
+
+    def remove_overlay(self, window):
+        if window in self.overlays:
+            self.overlays.remove(window)
+            self._overlays_changed = True
+
     def redraw(self):
+        """Redraws the entire layout on the next screen update."""
         self.stdscr.erase()
-        self.stdscr.refresh()
         self.layout.resize()
-        self.stdscr.refresh()
+
+    def update(self):
+        """Stages everything that changed and updates the screen once."""
+        start = time.time()
+        changed = self._overlays_changed or self.layout.dirty or \
+            self.layout.status_dirty or \
+            any(column.dirty for column in self.layout.columns)
+
+        if self._overlays_changed:
+            # Whatever was below an overlay that moved has to be staged
+            # again, which doesn't draw anything that didn't change.
+            self.stdscr.touchwin()
+            for column in self.layout.columns:
+                column.dirty = True
+
+        self.layout.update()
+
+        for window in self.overlays:
+            window.touchwin()
+            window.noutrefresh()
+
+        self._overlays_changed = False
+        curses.doupdate()
+
+        now = time.time()
+        if changed:
+            metrics.timing('ui frame', now - start)
+        if self._key_time is not None:
+            metrics.timing('ui key-to-paint', now - self._key_time)
+            self._key_time = None
 
     def update_size(self):
         self.height, self.width = self.stdscr.getmaxyx()
 
     def angry_horse(self, *status_line):
         # Use the angry horse if there's enough space for it.
-        rows, columns, lines = load_ascii_art('angry-horse')
+        horse = sprite('angry-horse')
 
         # Otherwise hope the dumb horse is small enough.
-        if rows >= self.height or columns >= self.width:
-            rows, columns, lines = load_ascii_art('dumb-horse')
+        if horse.rows >= self.height or horse.columns >= self.width:
+            horse = sprite('dumb-horse')
 
-        self.redraw()
+        self.status(*status_line)
 
-        for idx, line in enumerate(lines):
-            x = (self.width - columns) / 2
-            y = (self.height - rows) / 2 + idx
-            self.stdscr.addstr(y, x, line, curses.A_BOLD)
+        window = horse.window(horse.columns, curses.A_BOLD)
+        try:
+            window.mvwin((self.height - horse.rows) / 2,
+                         (self.width - horse.columns) / 2)
+        except curses.error:
+            return
 
-        self.layout.status(*status_line)
-        self.stdscr.refresh()
-        time.sleep(0.2)
-        self.redraw()
-        self.layout.status(*status_line)
+        self.remove_overlay(window)
+        self.add_overlay(window)
+
+        # Calm the horse down again after a bit, rather than sleeping and
+        # ignoring any keys in the meantime.
+        if self._angry_timer:
+            self._angry_timer.cancel()
+        self._angry_timer = self.loop.call_later(
+            self.ANGRY_TIMEOUT, self.remove_overlay, window)
+
+    def status(self, line, *args):
+        """Shows a status message which disappears after a while."""
+        self.layout.status(line, *args)
+
+        if self._status_timer:
+            self._status_timer.cancel()
+        self._status_timer = self.loop.call_later(self.STATUS_TIMEOUT,
+                                                  self._clear_status)
+
+    def _clear_status(self):
+        self._status_timer = None
+        if self.filter_query is None:
+            self.layout.status('')
+
+    def _log_metrics(self):
+        metrics.log_summary()
+        self.loop.call_later(self.METRICS_INTERVAL, self._log_metrics)
+
+    def _show_metrics(self):
+        parts = []
+        for label, name in (('rpc', 'rpc'), ('frame', 'ui frame'),
+                            ('key', 'ui key-to-paint')):
+            values = metrics.percentiles(name)
+            if values:
+                parts.append('%s %.1f/%.1fms' % ((label,) + values))
+
+        self.metrics_line = 'p50/p99 %s ' % ' | '.join(parts or ['-'])
+        self.layout.status_dirty = True
+        self._metrics_timer = self.loop.call_later(
+            self.METRICS_LINE_INTERVAL, self._show_metrics)
 
     def wait(self):
-        # Ensure the screen is entirely up-to-date before entering blocking
-        # mode. (Or, at least, normally this will be blocking mode.)
-        self.stdscr.refresh()
-
-        ch = self.stdscr.getch()
-        if ch < 0:
-            # If .getch() returns -1 then we're in non-blocking mode which is
-            # only the case when this has been specifically requested. Thus
-            # we allow the event to be handled.
-            self.redraw()
-            try:
-                self._nonblocking_handler()
-            except RemoveHorseHandler:
-                self._nonblocking_handler = None
-                self.stdscr.nodelay(0)
+        # Ensure the screen is entirely up-to-date before waiting for the
+        # next key or timer.
+        self.update()
+
+        if not self.loop.run_once():
             return
 
+        # Handle all keys that are available right now.
+        while True:
+            ch = self.stdscr.getch()
+            if ch < 0:
+                break
+
+            if self._key_time is None:
+                self._key_time = time.time()
+
+            if self.filter_query is not None:
+                self._handle_filter(ch)
+            else:
+                self._handle_key(ch)
+
+    def _handle_key(self, ch):
         # Check if we can resolve this character in our mapping and otherwise
         # use the .keyname() function to resolve it.
         key = self.characters.get(ch, curses.keyname(ch))
         log.debug('Received character %r (%d)', key, ch)
 
-        # Handle this event.
+        # Handle this event. The user is waiting for any calls made in
+        # the meantime, so these should rather fail quickly.
         try:
             if not hasattr(self, '_handle_%s' % key):
                 raise AngryHorseException('Unknown keybinding: %r.' % key)
 
-            getattr(self, '_handle_%s' % key)()
+            with self.mpd.interactive():
+                getattr(self, '_handle_%s' % key)()
         except AngryHorseException as e:
             self.angry_horse(e.message)
+        except RPCException as e:
+            log.info('Error handling %r: %s', key, e)
+            self.angry_horse('Error talking with the server: %s', e)
 
     def _handle_q(self):
         raise TranquilizerException
 
     def _handle_alt(self):
-        key = self.stdscr.getkey()
-        self.layout.current.handle_alt(key)
+        # The key following escape is normally available right away. If it
+        # isn't then this was just the escape key.
+        self.stdscr.timeout(50)
+        try:
+            ch = self.stdscr.getch()
+        finally:
+            self.stdscr.nodelay(1)
+
+        if ch >= 0:
+            self.layout.current.handle_alt(curses.keyname(ch))
 
     def _handle_resize(self):
-        self.layout.resize()
         self.update_size()
+        self.redraw()
 
     def _handle_h(self):
         self.layout.previous_column()
@@ -343,3 +727,84 @@ class Curse(object):
 
     def _handle_enter(self):
         self.layout.current.handle_enter()
+        self.redraw()
+
+    def _handle_o(self):
+        if self.loading is not None:
+            raise AngryHorseException('Still loading the bands.')
+
+        if self.bands_error is not None:
+            self.load_bands()
+            return
+
+        # Cycle through the orders in which bands can be listed.
+        orders = self.mpd.BAND_ORDERS
+        index = orders.index(self.mpd.band_order)
+        self.mpd.band_order = orders[(index + 1) % len(orders)]
+
+        # Bands that have expired are fetched once more in the background
+        # and are shown in the new order once they have been.
+        if self.mpd.bands_stale():
+            self.load_bands(refresh=True)
+            return
+
+        bands = self.mpd.bands()
+        for column in self.layout.columns:
+            if isinstance(column, BandsColumn):
+                column.populate(bands)
+                column.bands = bands
+
+        self.redraw()
+        self.status('Bands ordered by: %s', self.mpd.band_order)
+
+    def _handle_r(self):
+        if self.loading is not None:
+            raise AngryHorseException('Still loading the bands.')
+
+        # Forget everything about the library, which is then fetched once
+        # more as it's requested, starting with the bands.
+        self.mpd.invalidate()
+        self.column_cache.clear()
+        self.load_bands(refresh=self.bands_error is None)
+
+    def _handle_i(self):
+        # Toggle the live metrics on the status line.
+        if self._metrics_timer:
+            self._metrics_timer.cancel()
+            self._metrics_timer = self.metrics_line = None
+            self.layout.status_dirty = True
+        else:
+            self._show_metrics()
+
+    def _handle_slash(self):
+        self.filter_query = ''
+        self.layout.status('/')
+        self.redraw()
+
+    def _handle_filter(self, ch):
+        # Enter keeps the filter in place, escape removes it.
+        if ch == 10:
+            self.filter_query = None
+            self.layout.status('')
+            self.redraw()
+            return
+
+        if ch == 27:
+            self.filter_query = ''
+        elif ch in (8, 127, curses.KEY_BACKSPACE):
+            self.filter_query = self.filter_query[:-1]
+        elif 32 <= ch < 256:
+            self.filter_query += chr(ch)
+        else:
+            return
+
+        # Multi-byte characters are only complete after their last byte.
+        query = self.filter_query.decode('utf8', 'ignore')
+        self.layout.current.filter(query)
+
+        if ch == 27:
+            self.filter_query = None
+            self.layout.status('')
+        else:
+            self.layout.status('/%s', self.filter_query)
+        self.redraw()
@@ -2,9 +2,18 @@
 # This file is part of HorseMPDC - http://www.horsempdc.org/.
 # See the file 'docs/LICENSE.txt' for copying permission.
 
+import codecs
+import contextlib
+import itertools
 import json
 import logging
-import requests
+import random
+import re
+import threading
+import time
+
+from horsempdc.metrics import metrics
+from horsempdc.workers import SingleFlight
 
 
 class RPCException(Exception):
@@ -35,6 +44,19 @@ class RPCServerError(RPCException):
     pass
 
 
+class RPCConnectionError(RPCException):
+    """The server could not be reached or the connection broke down."""
+
+
+class RPCTimeout(RPCConnectionError):
+    """The server did not respond in time."""
+
+
+class RPCUnavailable(RPCConnectionError):
+    """Raised without contacting the server while the circuit breaker is
+    open, i.e., while the server appears to be down."""
+
+
 _CODES = {
     -32700: RPCParseError,
     -32600: InvalidRPCRequest,
@@ -43,39 +65,538 @@ _CODES = {
     -32603: InternalRPCError,
 }
 
+# Methods that only read state, which can safely be sent once more after
+# a request failed. Besides these, all methods that get something.
+IDEMPOTENT = frozenset([
+    'core.library.browse',
+    'core.library.lookup',
+    'core.library.search',
+])
+
 log = logging.getLogger(__name__)
 
 
+def _idempotent(method):
+    return method in IDEMPOTENT or \
+        method.rsplit('.', 1)[-1].startswith('get_')
+
+
+def _flight_key(method, params):
+    return method, json.dumps(params, sort_keys=True)
+
+
+def _connection_error(e):
+    """Translates an error raised by requests into the matching exception."""
+    import requests
+
+    if isinstance(e, requests.Timeout):
+        return RPCTimeout(str(e))
+    return RPCConnectionError(str(e))
+
+
+class CircuitBreaker(object):
+    """Fails fast while the server is down. After threshold consecutive
+    failures the circuit opens and requests fail right away. Once every
+    reset_timeout seconds one request is let through to find out whether
+    the server is back, which closes the circuit if it succeeds."""
+
+    def __init__(self, threshold=3, reset_timeout=10):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+
+            if time.time() - self.opened < self.reset_timeout:
+                return False
+
+            # Let this request through, but keep failing the others until
+            # it's known whether it succeeded.
+            self.opened = time.time()
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened is None:
+                    log.info('Server appears to be down, failing fast for '
+                             'the next %d seconds', self.reset_timeout)
+                self.opened = time.time()
+
+
+class _Stream(object):
+    """Decodes JSON values one by one from an iterable of chunks of bytes,
+    only reading as much of it as is required for the next value."""
+
+    WHITESPACE = re.compile(r'[ \t\r\n]*')
+    NUMBER = re.compile(r'[0-9.eE+-]*')
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf8')()
+        self.scan = json.JSONDecoder().scan_once
+        self.eof = False
+        self.buf = u''
+        self.pos = 0
+
+    def _more(self):
+        """Reads the next chunk and returns False at the end of the data.
+        Whatever has been decoded already is dropped from the buffer."""
+        if self.eof:
+            return False
+
+        try:
+            data = self.decoder.decode(next(self.chunks))
+        except StopIteration:
+            data = self.decoder.decode('', final=True)
+            self.eof = True
+
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _partial(self, buf, end):
+        """Returns whether the value ending at end may continue in the next
+        chunk, e.g., "5." of "5.25", which is accepted as 5 by itself."""
+        return not self.eof and self.NUMBER.match(buf, end).end() == len(buf)
+
+    def peek(self):
+        """Returns the next character that is not whitespace."""
+        while True:
+            self.pos = self.WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self._more():
+                raise ValueError('Unexpected end of JSON data')
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError('Expected %r at %r' % (
+                ch, self.buf[self.pos:self.pos + 32]))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            # A value is always followed by at least one other character,
+            # so a value at the end of the buffer, e.g., a number, may
+            # continue in the next chunk.
+            try:
+                value, end = self.scan(self.buf, self.pos)
+                if not self._partial(self.buf, end):
+                    self.pos = end
+                    return value
+            except (StopIteration, ValueError):
+                if self.eof:
+                    raise ValueError('Invalid JSON value at %r' % (
+                        self.buf[self.pos:self.pos + 32]))
+
+            self._more()
+
+    def items(self):
+        """Yields the values of the list at the current position. This is
+        the hot loop for large responses, so a value is only taken once
+        the separator following it has been received as well."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        match, scan = self.WHITESPACE.match, self.scan
+        while True:
+            buf = self.buf
+            try:
+                value, end = scan(buf, match(buf, self.pos).end())
+                end = match(buf, end).end()
+                separator = buf[end]
+            except (StopIteration, ValueError, IndexError):
+                if not self._more():
+                    raise ValueError('Unexpected end of JSON data')
+                continue
+
+            if separator != ',' and separator != ']':
+                if self._partial(buf, end):
+                    self._more()
+                    continue
+
+                raise ValueError('Expected "," or "]" at %r' % (
+                    buf[end:end + 32]))
+
+            self.pos = end + 1
+            yield value
+
+            if separator == ']':
+                return
+
+
+def _iter_result(chunks):
+    """Yields the items of the result list of a JsonRPC response as soon
+    as each of them has been received. A result that is not a list is
+    yielded as one item."""
+    stream = _Stream(chunks)
+
+    stream.expect('{')
+    while stream.peek() != '}':
+        key = stream.value()
+        stream.expect(':')
+
+        if key == 'result' and stream.peek() == '[':
+            for item in stream.items():
+                yield item
+        else:
+            value = stream.value()
+            if key == 'error':
+                raise _exception(value)
+            elif key == 'result':
+                yield value
+
+        if stream.peek() != ',':
+            break
+        stream.pos += 1
+    stream.expect('}')
+
+
+def _exception(error):
+    """Translates a JsonRPC error object into the matching exception."""
+    if error['code'] in _CODES:
+        return _CODES[error['code']](error['message'])
+    elif error['code'] >= -32000 and error['code'] < 32100:
+        return RPCServerError(error['message'])
+    else:
+        return RPCException('Unknown JsonRPC Exception #%d: %s' % (
+            error['code'], error['message']))
+
+
 class JsonRPC(object):
-    def __init__(self, url):
+    # Amount of bytes read at once from streamed responses.
+    CHUNK_SIZE = 65536
+
+    # Default seconds to wait for a connection to be established, and for
+    # the server to send anything once it has been.
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 30
+
+    # Amount of times a failed idempotent request is sent once more, and
+    # the seconds to wait before the first retry, which doubles for each
+    # further retry. The actual delay is a random fraction thereof, so that
+    # concurrent requests don't retry all at once.
+    RETRIES = 2
+    BACKOFF = 0.2
+
+    # Seconds to wait for the server while the user is waiting as well,
+    # in which case failed requests aren't retried either.
+    INTERACTIVE_TIMEOUT = 5
+
+    def __init__(self, url, pool_size=4, timeout=None, connect_timeout=None):
         self.url = url
+        self.timeout = (connect_timeout or self.CONNECT_TIMEOUT,
+                        timeout or self.READ_TIMEOUT)
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker()
 
-    def query(self, method, **params):
-        data = {
+        # Whether the calls of each thread are made interactively.
+        self.local = threading.local()
+
+        # Identical idempotent queries that are in flight at the same time,
+        # e.g., by the prefetcher and by the user, are only sent once.
+        self.flights = SingleFlight()
+
+        # The session is only set up for the first request, as importing
+        # requests takes a while, which would otherwise delay the startup.
+        self.adapter = None
+        self._session = None
+        self.lock = threading.Lock()
+
+        # Amount of requests sent through this session.
+        self.requests = 0
+
+        # Unique identifiers for each call so that responses to a batch
+        # request can be matched up with their calls.
+        self.ids = itertools.count(1)
+
+    @property
+    def session(self):
+        """One keep-alive session for all queries, so that each browse
+        request reuses an already established connection rather than
+        doing a new TCP handshake."""
+        with self.lock:
+            if self._session is None:
+                import requests
+                import requests.adapters
+
+                self.adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size
+                )
+
+                session = requests.Session()
+                session.headers['content-type'] = 'application/json'
+                session.mount('http://', self.adapter)
+                session.mount('https://', self.adapter)
+                self._session = session
+
+            return self._session
+
+    def connections(self):
+        """Returns the amount of connections opened so far."""
+        if not self.adapter:
+            return 0
+
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def stats(self):
+        """Returns connection reuse statistics for this session."""
+        connections = self.connections()
+        return {
+            'requests': self.requests,
+            'connections': connections,
+            'reused': max(self.requests - connections, 0),
+            'coalesced': self.flights.coalesced,
+        }
+
+    def close(self):
+        if self._session:
+            self._session.close()
+
+    @contextlib.contextmanager
+    def interactive(self):
+        """Calls made by this thread within this context are made on
+        behalf of the user, e.g., after a keypress, who'd rather see an
+        error than wait for the regular timeouts and retries."""
+        previous = getattr(self.local, 'interactive', False)
+        self.local.interactive = True
+        try:
+            yield
+        finally:
+            self.local.interactive = previous
+
+    def _interactive(self):
+        return getattr(self.local, 'interactive', False)
+
+    def _timeout(self):
+        if not self._interactive():
+            return self.timeout
+
+        return (min(self.timeout[0], self.INTERACTIVE_TIMEOUT),
+                min(self.timeout[1], self.INTERACTIVE_TIMEOUT))
+
+    def _call(self, method, params):
+        return {
             'jsonrpc': '2.0',
-            'id': 42,
+            'id': next(self.ids),
             'method': method,
             'params': params,
         }
 
-        headers = {
-            'content-type': 'application/json',
-        }
+    def _error(self, name):
+        metrics.count('rpc errors')
+        metrics.count('rpc %s errors' % name)
+
+    def _record(self, name, start, sent, received):
+        elapsed = time.time() - start
+        metrics.timing('rpc', elapsed)
+        metrics.timing('rpc %s' % name, elapsed)
+        metrics.count('rpc %s bytes sent' % name, sent)
+        metrics.count('rpc %s bytes received' % name, received)
+
+    def _send(self, send, idempotent):
+        """Returns send(), as long as the circuit breaker allows it. If
+        the request is idempotent, connection errors are retried with an
+        exponential backoff. Only a request that failed after all of its
+        retries counts as one failure towards opening the circuit."""
+        attempt = 0
+        retries = 0 if self._interactive() else self.RETRIES
+        while True:
+            if not self.breaker.allow():
+                raise RPCUnavailable('Server is unavailable')
 
+            try:
+                ret = send()
+            except RPCConnectionError as e:
+                if not idempotent or attempt >= retries:
+                    self.breaker.failure()
+                    raise
+
+                delay = random.uniform(0, self.BACKOFF * 2 ** attempt)
+                log.info('Error talking with API: %s, retrying in %.2fs',
+                         e, delay)
+                metrics.count('rpc retries')
+                time.sleep(delay)
+                attempt += 1
+            else:
+                self.breaker.success()
+                return ret
+
+    def _post(self, data, name, stream=False):
+        """Posts a request and records its latency and payload sizes
+        under the given name. A streamed response is returned as-is and
+        recorded by the caller once it has been read."""
+        self.requests += 1
+        body = json.dumps(data)
+
+        start = time.time()
         try:
-            r = requests.post(self.url, data=json.dumps(data),
-                              headers=headers).json()
-        except Exception as e:
-            log.info("Error talking with API: %s", e)
-            return []
+            r = self.session.post(self.url, data=body,
+                                  timeout=self._timeout(), stream=stream)
+            if stream:
+                return r, start, len(body)
+            content = r.content
+        except IOError as e:
+            self._error(name)
+            self._record(name, start, len(body), 0)
+            raise _connection_error(e)
+
+        self._record(name, start, len(body), len(content))
+        try:
+            return r.json()
+        except ValueError as e:
+            self._error(name)
+            raise RPCException('Invalid response: %s' % e)
+
+    def query(self, method, **params):
+        """Calls a method. The result of an idempotent call may be shared
+        with concurrent identical calls, so it must not be modified."""
+        if not _idempotent(method):
+            return self._query(method, params)
+
+        # The user isn't kept waiting any longer for an identical call that
+        # is running already than for the call itself.
+        key = _flight_key(method, params)
+        job = self.flights.jobs.get(key)
+        if job and self._interactive():
+            if not job.done.wait(self.INTERACTIVE_TIMEOUT):
+                raise RPCTimeout('Timed out waiting for %s' % method)
+            return job.wait()
+
+        return self.flights.run(key, self._query, method, params)
+
+    def _query(self, method, params):
+        r = self._send(lambda: self._post(self._call(method, params), method),
+                       _idempotent(method))
 
         if 'error' in r:
-            if r['error']['code'] in _CODES:
-                raise _CODES[r['error']['code']](r['error']['message'])
-            elif r['error']['code'] >= -32000 and r['error']['code'] < 32100:
-                raise RPCServerError(r['error']['message'])
-            else:
-                raise RPCException('Unknown JsonRPC Exception #%d: %s' % (
-                    r['error']['code'], r['error']['message']))
+            self._error(method)
+            raise _exception(r['error'])
 
         return r['result']
+
+    def query_iter(self, method, **params):
+        """Like query(), but yields the items of the result list one by
+        one while the response is still being received. Only the items
+        themselves are ever kept in memory, not the entire response. Only
+        establishing the request is retried, as any items that have been
+        yielded already can't be taken back."""
+        r, start, sent = self._send(
+            lambda: self._post(self._call(method, params), method, True),
+            _idempotent(method))
+        received = [0]
+
+        def chunks(r):
+            for chunk in r.iter_content(self.CHUNK_SIZE):
+                received[0] += len(chunk)
+                yield chunk
+
+        try:
+            for item in _iter_result(chunks(r)):
+                yield item
+        except RPCException:
+            self._error(method)
+            raise
+        except IOError as e:
+            self._error(method)
+            self.breaker.failure()
+            raise _connection_error(e)
+        except ValueError as e:
+            self._error(method)
+            raise RPCException('Invalid response: %s' % e)
+        finally:
+            r.close()
+            self._record(method, start, sent, received[0])
+
+    def query_many(self, calls):
+        """Sends a list of (method, params) calls as one batch request.
+
+        Returns the results in the same order as the calls. A call that
+        failed is represented by its exception instance, so that one bad
+        call does not throw away the results of all the others.
+
+        Idempotent calls that are in flight already, through query() or
+        another batch, aren't sent once more but share the result of the
+        call that is running."""
+        keys, jobs, sent = [], [], []
+        for idx, (method, params) in enumerate(calls):
+            key, job, leader = None, None, True
+            if _idempotent(method):
+                key = _flight_key(method, params)
+                job, leader = self.flights.join(key)
+
+            keys.append(key)
+            jobs.append(None if leader else job)
+            if leader:
+                sent.append((idx, job))
+
+        ret = [None] * len(calls)
+        rows = [RPCException('Batch request was not sent')] * len(sent)
+        try:
+            rows = self._batch([calls[idx] for idx, _ in sent])
+        finally:
+            for (idx, job), row in itertools.izip(sent, rows):
+                ret[idx] = row
+                if job and isinstance(row, Exception):
+                    self.flights.finish(keys[idx], job, error=row)
+                elif job:
+                    self.flights.finish(keys[idx], job, row)
+
+        for idx, job in enumerate(jobs):
+            if job:
+                try:
+                    ret[idx] = job.wait()
+                except RPCException as e:
+                    ret[idx] = e
+        return ret
+
+    def _batch(self, calls):
+        """Sends calls as one batch request, see query_many()."""
+        if not calls:
+            return []
+
+        data = [self._call(method, params) for method, params in calls]
+        idempotent = all(_idempotent(method) for method, _ in calls)
+
+        try:
+            rows = self._send(lambda: self._post(data, 'batch'), idempotent)
+        except RPCException as e:
+            log.info("Error talking with API: %s", e)
+            return [e for _ in calls]
+
+        # A server that does not understand batch requests replies with a
+        # single error object.
+        if isinstance(rows, dict):
+            return [_exception(rows['error']) for _ in calls]
+
+        responses = dict((row.get('id'), row) for row in rows)
+
+        ret = []
+        for call in data:
+            r = responses.get(call['id'])
+            if r is None:
+                ret.append(RPCException('No response for call #%d (%s)' % (
+                    call['id'], call['method'])))
+            elif 'error' in r:
+                ret.append(_exception(r['error']))
+            else:
+                ret.append(r['result'])
+        return ret
@@ -0,0 +1,53 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import re
+import struct
+import threading
+
+_PREFIX = re.compile(r'.*[?&=:/]')
+_INDEX = struct.Struct('<I')
+
+
+class Names(object):
+    """Interns names, so that equal names, e.g., the same album or track
+    name by different bands, are kept in memory only once."""
+
+    def __init__(self):
+        self.names = {}
+
+    def __call__(self, name):
+        return self.names.setdefault(name, name)
+
+
+class URIs(object):
+    """Packs URIs into short byte strings. The URIs of a library share long
+    prefixes, e.g., the directory of a band is the prefix of each of its
+    albums, so each URI is stored as the index of its prefix, i.e., all
+    up to its last separator, followed by the utf-8 encoded remainder."""
+
+    def __init__(self):
+        self.prefixes = []
+        self.index = {}
+
+        # URIs are packed by background fetches as well.
+        self.lock = threading.Lock()
+
+    def pack(self, uri):
+        uri = uri.encode('utf8')
+
+        match = _PREFIX.match(uri)
+        prefix = match.group() if match else ''
+
+        if prefix not in self.index:
+            with self.lock:
+                if prefix not in self.index:
+                    self.index[prefix] = len(self.prefixes)
+                    self.prefixes.append(prefix)
+
+        return _INDEX.pack(self.index[prefix]) + uri[len(prefix):]
+
+    def unpack(self, packed):
+        index, = _INDEX.unpack_from(packed)
+        return (self.prefixes[index] + packed[_INDEX.size:]).decode('utf8')
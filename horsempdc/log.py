@@ -6,7 +6,7 @@ import logging
 import logging.handlers
 import os.path
 
-from horsempdc.config import CONFDIR
+from horsempdc.config import CONFDIR, init_confdir
 
 
 log = logging.getLogger()
@@ -16,6 +16,7 @@ def init_logging(level=logging.INFO):
     formatter = logging.Formatter(
         '%(asctime)s [%(name)s] %(levelname)s: %(message)s')
 
+    init_confdir()
     log_path = os.path.join(CONFDIR, 'horsempdc.log')
     fh = logging.handlers.WatchedFileHandler(log_path)
     fh.setFormatter(formatter)
@@ -0,0 +1,90 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import collections
+import errno
+import heapq
+import itertools
+import logging
+import os
+import select
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Timer(object):
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(object):
+    """Waits for input on a file descriptor while running timers, so that
+    animations and other delayed work never block reading keystrokes.
+    Timers are kept in a heap, ordered by the time they're due."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.timers = []
+        self.sequence = itertools.count()
+
+        # Callbacks scheduled by other threads and the pipe that is used to
+        # wake up the loop when that happens.
+        self.pending = collections.deque()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(time.time() + delay, callback, args)
+        heapq.heappush(self.timers, (timer.when, next(self.sequence), timer))
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Schedules a callback from another thread."""
+        self.pending.append((callback, args))
+        os.write(self.wakeup_w, 'x')
+
+    def _timeout(self):
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+
+        if self.timers:
+            return max(self.timers[0][0] - time.time(), 0)
+
+    def _run_timers(self):
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+
+    def _run_pending(self):
+        os.read(self.wakeup_r, 4096)
+        while self.pending:
+            callback, args = self.pending.popleft()
+            callback(*args)
+
+    def run_once(self):
+        """Waits until input is available or a timer is due, runs whatever
+        is due and returns whether input is available."""
+        try:
+            readable, _, _ = select.select(
+                [self.fd, self.wakeup_r], [], [], self._timeout())
+        except select.error as e:
+            # Interrupted, e.g., by a SIGWINCH when resizing the terminal,
+            # in which case ncurses may have queued a resize event.
+            if e.args[0] != errno.EINTR:
+                raise
+            readable = [self.fd]
+
+        if self.wakeup_r in readable:
+            self._run_pending()
+
+        self._run_timers()
+        return self.fd in readable
@@ -0,0 +1,106 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import bisect
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Histogram(object):
+    """Latency histogram with a fixed set of buckets. Each bucket is 20%
+    wider than the previous one, from 10 microseconds up to about two
+    minutes, so percentiles are accurate to within 20%."""
+
+    BOUNDS = [0.00001 * 1.2 ** idx for idx in xrange(90)]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """Returns the upper bound of the bucket holding the percentile."""
+        target = self.count * percent / 100.0
+        seen = 0
+        for idx, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                break
+
+        if idx == len(self.BOUNDS):
+            return self.max
+        return min(self.BOUNDS[idx], self.max)
+
+
+class Metrics(object):
+    """Latency histograms and counters, e.g., of RPC calls and frames.
+    They are updated from multiple threads."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+        # Amount of samples at the time of the last logged summary.
+        self.logged = 0
+
+    def timing(self, name, seconds):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def percentiles(self, name):
+        """Returns the p50 and p99 of a histogram in milliseconds."""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if not histogram or not histogram.count:
+                return None
+
+            return (histogram.percentile(50) * 1000,
+                    histogram.percentile(99) * 1000)
+
+    def summary(self):
+        """Returns one line per histogram and counter."""
+        lines = []
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append(
+                    '%s: %d calls, p50 %.1fms, p99 %.1fms, max %.1fms' % (
+                        name, histogram.count,
+                        histogram.percentile(50) * 1000,
+                        histogram.percentile(99) * 1000,
+                        histogram.max * 1000))
+
+            for name, value in sorted(self.counters.items()):
+                lines.append('%s: %d' % (name, value))
+        return lines
+
+    def log_summary(self):
+        """Logs the summary, unless nothing happened since last time."""
+        with self.lock:
+            samples = sum(h.count for h in self.histograms.values())
+            if samples == self.logged:
+                return
+            self.logged = samples
+
+        for line in self.summary():
+            log.info('%s', line)
+
+
+# Metrics of the entire application.
+metrics = Metrics()
@@ -2,37 +2,316 @@
 # This file is part of HorseMPDC - http://www.horsempdc.org/.
 # See the file 'docs/LICENSE.txt' for copying permission.
 
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+
 from horsempdc.abstract import MPD
-from horsempdc.jsonrpc import JsonRPC
+from horsempdc.cache import Cache
+from horsempdc.jsonrpc import JsonRPC, RPCException
+from horsempdc.websocket import WebSocket
+from horsempdc.workers import WorkerPool
+
+log = logging.getLogger(__name__)
+
+# Rough amount of bytes taken by a packed URI and by the details of a
+# track, i.e., whatever sys.getsizeof() doesn't account for.
+_URI_SIZE = 64
+_DETAILS_SIZE = 72
+
+
+def _sizeof_albums(albums):
+    # The names of the albums are interned, so they're not counted.
+    return sys.getsizeof(albums) + len(albums) * _URI_SIZE
+
+
+def _sizeof_tracks(tracks):
+    names, uris = tracks
+    return sys.getsizeof(names) + sys.getsizeof(uris) + \
+        sum(sys.getsizeof(name) for name in names) + len(uris) * _URI_SIZE
+
+
+def _sizeof_details(details):
+    return sys.getsizeof(details) + len(details) * (_URI_SIZE + _DETAILS_SIZE)
 
 
 class MopidyClient(MPD):
-    def __init__(self, host):
+    # Seconds to wait before reconnecting to the event websocket.
+    RECONNECT_DELAY = 5
+
+    # Default amount of bytes that the albums, tracks and track details
+    # may take in memory, and the seconds after which they're fetched once
+    # more, by the method that returned them.
+    CACHE_BUDGET = 64 * 1024 * 1024
+    TTLS = {
+        'core.library.browse': 3600,
+        'core.library.lookup': 24 * 3600,
+    }
+
+    # Bands loaded from the snapshot only expire once they've been
+    # revalidated.
+    BANDS_TTL = TTLS['core.library.browse']
+
+    def __init__(self, host, jsonrpc=None, pool_size=4, timeout=None,
+                 connect_timeout=None, cache_budget=None):
         MPD.__init__(self, host)
 
+        # Rather than growing without limit during long sessions, the
+        # library is kept in a cache that evicts whatever was used least
+        # recently, which is simply fetched once more if requested again.
+        self.cache = Cache(cache_budget or self.CACHE_BUDGET)
+        browse = self.TTLS['core.library.browse']
+        self._albums = self.cache.view('albums', _sizeof_albums, browse,
+                                       self._albums_evicted)
+        self._tracks = self.cache.view('tracks', _sizeof_tracks, browse)
+        self._details = self.cache.view('details', _sizeof_details,
+                                        self.TTLS['core.library.lookup'])
+
         if ':' in self.host:
             host, port = self.host.split(':')
         else:
             port = 6680
 
-        self.jsonrpc = JsonRPC('http://%s:%s/mopidy/rpc' % (host, port))
+        self.events_url = 'ws://%s:%s/mopidy/ws' % (host, port)
+        self.listening = False
+
+        # Cached state that is kept up-to-date through events.
+        self._tracklist = None
+        self.state = None
+
+        self.on('tracklist_changed', self._tracklist_changed)
+        self.on('playback_state_changed', self._playback_state_changed)
+
+        # An existing JsonRPC instance may be passed along in order to
+        # share its keep-alive session between multiple clients.
+        if jsonrpc is None:
+            jsonrpc = JsonRPC('http://%s:%s/mopidy/rpc' % (host, port),
+                              pool_size=pool_size, timeout=timeout,
+                              connect_timeout=connect_timeout)
+
+        self.jsonrpc = jsonrpc
         self.query = self.jsonrpc.query
+        self.query_iter = self.jsonrpc.query_iter
+        self.query_many = self.jsonrpc.query_many
+        self.interactive = self.jsonrpc.interactive
 
-    def bands(self):
-        if not self._bands:
-            rows = self.query('core.library.browse', uri='local:directory')
+    def listen(self):
+        """Starts receiving the events pushed by Mopidy over its websocket,
+        which keep the cached state up-to-date without polling."""
+        self.listening = True
 
-            for row in rows:
-                self._bands[row['name']] = row['uri']
+        t = threading.Thread(target=self._listen)
+        t.daemon = True
+        t.start()
 
-        return self._bands_ordered()
+    def _listen(self):
+        while self.listening:
+            ws = WebSocket(self.events_url)
+            try:
+                ws.connect()
+
+                # Anything may have changed while no events were received,
+                # including before the first connection, so the tracklist
+                # is fetched once more.
+                self.emit('tracklist_changed', {})
+
+                while self.listening:
+                    message = ws.recv()
+                    if message is None:
+                        break
+
+                    data = json.loads(message)
+
+                    # Besides events the websocket also carries JsonRPC
+                    # responses, which we don't use.
+                    if 'event' in data:
+                        self.emit(data['event'], data)
+            except Exception as e:
+                log.info('Error receiving events: %s', e)
+            finally:
+                ws.close()
+
+            if self.listening:
+                time.sleep(self.RECONNECT_DELAY)
+
+    def _tracklist_changed(self, data):
+        self._tracklist = None
+
+    def _playback_state_changed(self, data):
+        self.state = data.get('new_state')
+
+    def tracklist(self):
+        """Returns the names of the tracks in the tracklist."""
+        if self._tracklist is None:
+            rows = self.query('core.tracklist.get_tracks')
+            self._tracklist = [row['name'] for row in rows]
+
+        return self._tracklist
+
+    def _fetch_bands(self):
+        # The root directory lists every band, so rather than decoding the
+        # entire response at once each band is added as soon as it has
+        # been received.
+        for row in self.query_iter('core.library.browse',
+                                   uri='local:directory'):
+            yield row['name'], row['uri']
+
+    def _add_albums(self, band, rows):
+        if band not in self._albums:
+            self._set_albums(band, [])
 
-    def albums(self, band):
-        rows = self.query('core.library.browse', uri=self._bands[band])
         for row in rows:
-            if band not in self._albums:
-                self._albums[band] = {}
+            self._add_album(band, row['name'], row['uri'])
 
-            self._albums[band][row['name']] = row['uri']
+    def albums(self, band):
+        if band not in self._albums:
+            rows = self._snapshot_albums(band)
+            if rows is not None:
+                self._set_albums(band, rows)
+            else:
+                rows = self.query('core.library.browse',
+                                  uri=self.band_uri(band))
+                self._add_albums(band, rows)
 
         return self._albums_ordered(band)
+
+    def revalidate(self, batch_size=64):
+        """Brings the library as loaded from the snapshot up-to-date.
+
+        Mopidy does not expose modification times, so the directory of
+        each band that we know albums of is browsed once more, batch_size
+        bands per round trip, and only bands that actually changed are
+        updated. Returns True if anything changed."""
+        rows = self.query_iter('core.library.browse', uri='local:directory')
+        bands = self._pack((row['name'], row['uri']) for row in rows)
+        if not bands:
+            return False
+
+        changed = bands != self._bands
+
+        known = []
+        for band, uri in bands.items():
+            if self._bands.get(band) == uri and \
+                    self._snapshot_albums(band) is not None:
+                known.append(band)
+
+        albums = {}
+        for band in known:
+            albums[band] = self._pack(self._snapshot_albums(band))
+
+        for idx in xrange(0, len(known), batch_size):
+            batch = known[idx:idx + batch_size]
+            calls = [('core.library.browse',
+                      {'uri': self._uris.unpack(bands[band])})
+                     for band in batch]
+
+            for band, rows in zip(batch, self.query_many(calls)):
+                if isinstance(rows, RPCException):
+                    continue
+
+                new = self._pack((row['name'], row['uri']) for row in rows)
+                if new != albums[band]:
+                    albums[band] = new
+                    changed = True
+
+        self._bands_expire = time.time() + self.BANDS_TTL
+
+        if changed:
+            self._snapshot_index = {}
+            self._albums.clear()
+            self._albums.update(albums)
+            self._set_bands(bands)
+
+        return changed
+
+    def _add_tracks(self, band, album, rows):
+        self._set_tracks(band, album, [(row['name'], row['uri'])
+                                       for row in rows
+                                       if row['type'] == 'track'])
+
+    def tracks(self, band, album):
+        if (band, album) not in self._tracks:
+            # The albums of the band may have been evicted in the meantime.
+            if band not in self._albums:
+                self.albums(band)
+
+            rows = self.query('core.library.browse',
+                              uri=self.album_uri(band, album))
+            self._add_tracks(band, album, rows)
+
+        return self._tracks_ordered(band, album)
+
+    def lookup(self, uris):
+        """Looks up multiple tracks in one round trip."""
+        result = self.query('core.library.lookup', uris=uris)
+
+        details = {}
+        for uri, tracks in result.items():
+            if not tracks:
+                continue
+
+            # Mopidy reports the length in milliseconds.
+            length = tracks[0].get('length')
+            if length is not None:
+                length /= 1000
+
+            details[uri] = tracks[0].get('track_no'), length
+        return details
+
+    def crawl(self, concurrency=8, tracks=True):
+        """Walks the entire library, i.e., all bands, their albums and,
+        optionally, their tracks. Up to concurrency requests are in flight
+        at any given time, so the time this takes is bound by the server
+        rather than by the latency of each sequential round trip."""
+        pool = WorkerPool(concurrency)
+
+        # A directory that couldn't be browsed is skipped, rather than
+        # caching it as an empty one, and is browsed once more when it's
+        # requested.
+        def browse(uri):
+            try:
+                return self.query('core.library.browse', uri=uri)
+            except RPCException as e:
+                log.info('Error browsing %r: %s', uri, e)
+                return e
+
+        try:
+            bands = self.bands()
+            results = pool.imap(browse,
+                                [self.band_uri(band) for band in bands])
+            for band, rows in itertools.izip(bands, results):
+                if not isinstance(rows, RPCException):
+                    self._add_albums(band, rows)
+
+            if not tracks:
+                return
+
+            albums = []
+            for band in bands:
+                for album in self._albums.get(band, {}):
+                    albums.append((band, album))
+
+            uris = [self.album_uri(band, album) for band, album in albums]
+            results = pool.imap(browse, uris)
+            for (band, album), rows in itertools.izip(albums, results):
+                if not isinstance(rows, RPCException):
+                    self._add_tracks(band, album, rows)
+        finally:
+            pool.close()
+
+    def albums_many(self, bands):
+        """Fetches the albums of multiple bands in one round trip."""
+        calls = []
+        for band in bands:
+            calls.append(('core.library.browse',
+                          {'uri': self.band_uri(band)}))
+
+        for band, rows in zip(bands, self.query_many(calls)):
+            if isinstance(rows, RPCException):
+                log.info('Error fetching albums of %r: %s', band, rows)
+                continue
+
+            self._add_albums(band, rows)
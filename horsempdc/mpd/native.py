@@ -0,0 +1,220 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import logging
+import socket
+import threading
+import time
+
+from horsempdc.abstract import MPD
+from horsempdc.jsonrpc import RPCException
+from horsempdc.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class MPDProtocolError(RPCException):
+    """Error reported by the MPD daemon, i.e., an ACK response."""
+
+
+def _quote(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _int(value):
+    """Parses a number such as the track number, which may be given as,
+    e.g., "3/12", or returns None if it isn't a number."""
+    try:
+        return int(value.split('/')[0])
+    except ValueError:
+        return None
+
+
+def _tracks(pairs):
+    """Yields the file, title, track number and length of each track in a
+    response, in which each track starts with its file followed by its
+    tags."""
+    track = None
+    for key, value in pairs:
+        if key == 'file':
+            if track:
+                yield track
+            track = [value, None, None, None]
+        elif not track:
+            continue
+        elif key == 'Title':
+            track[1] = value
+        elif key == 'Track':
+            track[2] = _int(value)
+        elif key == 'Time':
+            track[3] = _int(value)
+
+    if track:
+        yield track
+
+
+class NativeClient(MPD):
+    """Talks the MPD protocol directly over one persistent TCP connection.
+    Multiple commands are pipelined in one command list, and responses are
+    parsed line by line as they come in."""
+
+    # Maximum amount of commands in one command list.
+    BATCH_SIZE = 128
+
+    def __init__(self, host, timeout=None):
+        MPD.__init__(self, host)
+
+        if ':' in self.host:
+            host, port = self.host.split(':')
+        else:
+            port = 6600
+
+        self.address = host, int(port)
+        self.timeout = timeout
+
+        self.sock = None
+        self.rfile = None
+
+        # The connection is shared with background fetches.
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, self.timeout)
+        self.rfile = self.sock.makefile('rb')
+
+        greeting = self.rfile.readline()
+        if not greeting.startswith('OK MPD '):
+            raise MPDProtocolError('Unexpected greeting: %r' % greeting)
+
+    def close(self):
+        if self.sock:
+            self.rfile.close()
+            self.sock.close()
+            self.sock = self.rfile = None
+
+    def _lines(self):
+        """Yields the lines of a response until and including the line
+        that terminates it."""
+        while True:
+            line = self.rfile.readline()
+            if not line.endswith('\n'):
+                raise socket.error('Connection closed by MPD')
+
+            line = line[:-1]
+            yield line
+
+            if line == 'OK' or line.startswith('ACK '):
+                return
+
+    def _command_list(self, commands):
+        """Sends a batch of commands in one go and returns the list of
+        (key, value) pairs of each command."""
+        request = ['command_list_ok_begin']
+        for command in commands:
+            request.append(' '.join(
+                [command[0]] + [_quote(arg) for arg in command[1:]]))
+        request.append('command_list_end')
+
+        body = '\n'.join(request) + '\n'
+        name = 'rpc mpd.%s' % commands[0][0]
+        metrics.count('%s bytes sent' % name, len(body))
+
+        start = time.time()
+        self.sock.sendall(body)
+
+        ret, pairs, received = [], [], 0
+        try:
+            for line in self._lines():
+                received += len(line) + 1
+                if line == 'list_OK':
+                    ret.append(pairs)
+                    pairs = []
+                elif line.startswith('ACK '):
+                    metrics.count('rpc errors')
+                    metrics.count('%s errors' % name)
+                    raise MPDProtocolError(line[4:])
+                elif line != 'OK':
+                    key, _, value = line.partition(': ')
+                    pairs.append((key, value.decode('utf8', 'replace')))
+        finally:
+            elapsed = time.time() - start
+            metrics.timing('rpc', elapsed)
+            metrics.timing(name, elapsed)
+            metrics.count('%s bytes received' % name, received)
+        return ret
+
+    def execute(self, commands):
+        """Executes a list of commands, each a tuple of the command and
+        its arguments, reconnecting once if the connection was lost."""
+        with self.lock:
+            for attempt in xrange(2):
+                try:
+                    if not self.sock:
+                        self.connect()
+
+                    ret = []
+                    for idx in xrange(0, len(commands), self.BATCH_SIZE):
+                        ret.extend(self._command_list(
+                            commands[idx:idx + self.BATCH_SIZE]))
+                    return ret
+                except socket.error as e:
+                    log.info('Lost connection to MPD: %s', e)
+                    self.close()
+                    if attempt:
+                        raise
+
+    def _fetch_bands(self):
+        pairs, = self.execute([('list', 'albumartist')])
+        for key, value in pairs:
+            if key == 'AlbumArtist' and value:
+                yield value, value
+
+    def _add_albums(self, band, pairs):
+        if band not in self._albums:
+            self._set_albums(band, [])
+
+        for key, value in pairs:
+            if key == 'Album':
+                self._add_album(band, value, value)
+
+    def albums(self, band):
+        if band not in self._albums:
+            self.albums_many([band])
+        return self._albums_ordered(band)
+
+    def albums_many(self, bands):
+        commands = [('list', 'album', 'albumartist', self.band_uri(band))
+                    for band in bands]
+
+        for band, pairs in zip(bands, self.execute(commands)):
+            self._add_albums(band, pairs)
+
+    def tracks(self, band, album):
+        if (band, album) not in self._tracks:
+            pairs, = self.execute([
+                ('find', 'albumartist', self.band_uri(band),
+                 'album', self.album_uri(band, album)),
+            ])
+
+            # The details of each track are part of the response already.
+            tracks, details = [], {}
+            for uri, title, track_no, length in _tracks(pairs):
+                tracks.append((title or uri, uri))
+                details[uri] = track_no, length
+
+            self._set_tracks(band, album, tracks)
+            self._set_details(band, album, details)
+
+        return self._tracks_ordered(band, album)
+
+    def lookup(self, uris):
+        commands = [('find', 'file', uri) for uri in uris]
+
+        details = {}
+        for pairs in self.execute(commands):
+            for uri, _, track_no, length in _tracks(pairs):
+                details[uri] = track_no, length
+        return details
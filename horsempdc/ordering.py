@@ -0,0 +1,112 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import bisect
+import locale
+import threading
+
+
+def collate(name):
+    """Returns the locale collation key of a name."""
+    if isinstance(name, unicode):
+        name = name.encode(locale.getpreferredencoding(False), 'replace')
+    return locale.strxfrm(name)
+
+
+def collate_the(name):
+    """Collation key that ignores a leading "The", e.g., for bands."""
+    if name[:4].lower() == 'the ':
+        name = name[4:]
+    return collate(name)
+
+
+class SortedView(object):
+    """List of names kept sorted by a key function. The key of each name
+    is calculated once, when the name is added, and names are inserted at
+    their sorted position, so the list never has to be sorted again."""
+
+    def __init__(self, key, names=()):
+        self.key = key
+
+        # The key of each name and the keys and names in the same sorted
+        # order, where names with equal keys are ordered by name.
+        self.key_of = dict((name, self.key(name)) for name in names)
+
+        # The initial set of names is sorted once.
+        pairs = sorted((key, name) for name, key in self.key_of.items())
+        self.keys = [key for key, _ in pairs]
+        self.names = [name for _, name in pairs]
+
+        # Copy of the names handed out by SortedViews, which is only made
+        # again after a change, so that all columns share one list.
+        self.published = None
+
+    def _index(self, key, name):
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        return bisect.bisect_left(self.names, name, lo, hi)
+
+    def add(self, name):
+        if name in self.key_of:
+            self.remove(name)
+
+        key = self.key(name)
+        idx = self._index(key, name)
+        self.keys.insert(idx, key)
+        self.names.insert(idx, name)
+        self.key_of[name] = key
+        self.published = None
+
+    # Recalculates the key of an existing name and moves it accordingly.
+    update = add
+
+    def remove(self, name):
+        key = self.key_of.pop(name)
+        idx = self._index(key, name)
+        del self.keys[idx]
+        del self.names[idx]
+        self.published = None
+
+
+class SortedViews(object):
+    """The sorted views of one set of names, one view per order. A view is
+    only built once its order is requested for the first time and is then
+    maintained as names are added or removed."""
+
+    def __init__(self, orders, names):
+        self.orders = orders
+        self.names = names
+        self.views = {}
+
+        # Names may be added by background fetches.
+        self.lock = threading.Lock()
+
+    def ordered(self, order):
+        """Returns the names in the given order. The list is shared and
+        must not be modified."""
+        with self.lock:
+            if order not in self.views:
+                self.views[order] = SortedView(self.orders[order],
+                                               self.names.keys())
+
+            view = self.views[order]
+            if view.published is None:
+                view.published = list(view.names)
+            return view.published
+
+    def add(self, name):
+        with self.lock:
+            for view in self.views.values():
+                view.add(name)
+
+    def update(self, name, order=None):
+        with self.lock:
+            for key, view in self.views.items():
+                if order is None or key == order:
+                    view.update(name)
+
+    def remove(self, name):
+        with self.lock:
+            for view in self.views.values():
+                view.remove(name)
@@ -0,0 +1,87 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import logging
+import Queue
+import threading
+
+from horsempdc.workers import WorkerPool
+
+log = logging.getLogger(__name__)
+
+
+class AlbumPrefetcher(object):
+    """Fetches the albums of the bands around the cursor in the background,
+    so that opening a band is usually served from memory."""
+
+    # Seconds to wait for a fetch of the band that is being opened. If
+    # the fetch takes longer, the albums are requested by themselves,
+    # which shares the result of the fetch if it's still running.
+    WAIT_TIMEOUT = 1
+
+    def __init__(self, mpd, radius=3, workers=2, maxsize=4):
+        self.mpd = mpd
+        self.radius = radius
+        self.pool = WorkerPool(workers, maxsize)
+
+        # Bands near the cursor, closest first.
+        self.wanted = []
+
+        # Job that has been queued but not picked up by a worker yet.
+        self.job = None
+
+        # Events of the fetches that are currently running, by band. The
+        # workers pick bands to fetch concurrently, so they take the lock.
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def _fetch(self):
+        # Only now decide what to fetch. If the user scrolled away quickly
+        # in the meantime then the bands of earlier positions are simply
+        # never requested.
+        done = threading.Event()
+        with self.lock:
+            bands = [band for band in self.wanted
+                     if band not in self.mpd._albums and
+                     band not in self.inflight]
+            for band in bands:
+                self.inflight[band] = done
+
+        if not bands:
+            return
+
+        try:
+            self.mpd.albums_many(bands)
+        finally:
+            with self.lock:
+                for band in bands:
+                    self.inflight.pop(band, None)
+            done.set()
+
+    def prefetch(self, lines, index):
+        start = max(index - self.radius, 0)
+        end = min(index + self.radius + 1, len(lines))
+
+        # Start with the highlighted band, then work outwards.
+        indices = sorted(xrange(start, end), key=lambda x: abs(x - index))
+        self.wanted = [lines[idx] for idx in indices]
+
+        # A queued job that hasn't started yet will pick up the new
+        # position by itself.
+        if self.job and not self.job.started:
+            return
+
+        try:
+            self.job = self.pool.submit(self._fetch)
+        except Queue.Full:
+            log.debug('Prefetch queue full, skipping prefetch')
+
+    def albums(self, band):
+        """Returns the albums of a band, waiting for an in-flight prefetch
+        of this band rather than sending the same request again."""
+        done = self.inflight.get(band)
+        if done:
+            done.wait(self.WAIT_TIMEOUT)
+
+        return self.mpd.albums(band)
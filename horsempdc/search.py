@@ -0,0 +1,138 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import bisect
+import re
+import threading
+import unicodedata
+
+_NON_ASCII = re.compile(u'[^\x00-\x7f]+')
+
+# Separates the folded lines, which no folded query ever contains.
+_SEPARATOR = u'\x00'
+
+
+def _strip_combining(match):
+    return u''.join(ch for ch in match.group()
+                    if not unicodedata.combining(ch))
+
+
+def fold(text):
+    """Folds a string for matching, i.e., lowercases it and strips any
+    diacritics, so that a query without accents matches accented names."""
+    if isinstance(text, str):
+        text = text.decode('utf8', 'replace')
+
+    # Only runs of non-ASCII characters may hold any diacritics.
+    text = unicodedata.normalize('NFKD', text.lower())
+    return _NON_ASCII.sub(_strip_combining, text)
+
+
+def _join(lines):
+    try:
+        return _SEPARATOR.join(lines)
+    except UnicodeDecodeError:
+        return _SEPARATOR.join(
+            line.decode('utf8', 'replace') if isinstance(line, str) else line
+            for line in lines)
+
+
+class SearchIndex(object):
+    """Folded copy of the lines of a column, in which a query matches
+    any line that contains it. The folded lines are also joined into one
+    string, which is searched as a whole rather than line by line.
+
+    Lines that are appended to the list of lines later on, e.g., while
+    it's still being received, are folded once they're searched, or in
+    the background by start()."""
+
+    # Least amount of lines that haven't been folded yet for start() to
+    # fold them in the background, rather than once they're searched.
+    BACKGROUND = 1000
+
+    def __init__(self, lines):
+        self.lines = lines
+
+        self.folded = []
+        self.text = None
+        self.starts = []
+        self.lock = threading.Lock()
+
+        # The most recent query and its results, so that typing one more
+        # character only has to narrow down the previous results.
+        self.last_query = None
+        self.last_results = None
+
+    def start(self):
+        """Folds the lines that haven't been folded yet in a background
+        thread, if there are enough of them."""
+        if len(self.lines) - len(self.folded) < self.BACKGROUND:
+            return
+
+        t = threading.Thread(target=self.update)
+        t.daemon = True
+        t.start()
+
+    def update(self):
+        """Folds the lines that haven't been folded yet."""
+        with self.lock:
+            count = len(self.folded)
+            lines = self.lines[count:]
+            if not lines:
+                return
+
+            # Folding all lines at once is a lot faster than folding them
+            # one by one, unless a line contains the separator.
+            folded = fold(_join(lines)).split(_SEPARATOR)
+            if len(folded) != len(lines):
+                folded = [fold(line) for line in lines]
+
+            position = self.starts[-1] + len(self.folded[-1]) + 1 \
+                if count else 0
+            for line in folded:
+                self.starts.append(position)
+                position += len(line) + 1
+
+            self.folded.extend(folded)
+
+            self.text = _SEPARATOR.join(self.folded)
+            self.last_query = self.last_results = None
+
+    def search(self, query):
+        """Returns the sorted indices of all lines matching the query."""
+        self.update()
+
+        query = fold(query).replace(_SEPARATOR, u'')
+        if not query.strip():
+            return range(len(self.folded))
+
+        if self.last_query and query.startswith(self.last_query):
+            results = [idx for idx in self.last_results
+                       if query in self.folded[idx]]
+        else:
+            results = self._scan(query)
+
+        self.last_query, self.last_results = query, results
+        return results
+
+    def _scan(self, query):
+        text, starts = self.text, self.starts
+
+        # Checking each line is cheaper than finding each match when most
+        # of the lines match.
+        if text.count(query) > len(starts) / 8:
+            return [idx for idx, line in enumerate(self.folded)
+                    if query in line]
+
+        # Otherwise, only the lines that match are visited, continuing
+        # after the line of each match.
+        results, count = [], len(starts)
+        position = text.find(query)
+        while position >= 0:
+            idx = bisect.bisect_right(starts, position) - 1
+            results.append(idx)
+            if idx + 1 == count:
+                break
+            position = text.find(query, starts[idx + 1])
+        return results
@@ -0,0 +1,136 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import logging
+import mmap
+import os
+import struct
+
+log = logging.getLogger(__name__)
+
+# The snapshot is a flat file which is memory-mapped when loaded, so that
+# only the parts that are actually needed are ever parsed. Its layout is:
+#
+#   header      magic, version, band count, album count
+#   bands       name offset, uri offset, first album, album count
+#   albums      name offset, uri offset
+#   strings     length-prefixed utf-8 strings
+#
+# An album count of UNKNOWN indicates that the albums of a band were never
+# browsed when the snapshot was written.
+
+MAGIC = 'HMPD'
+VERSION = 2
+UNKNOWN = 0xffffffff
+
+_HEADER = struct.Struct('<4sIII')
+_BAND = struct.Struct('<IIII')
+_ALBUM = struct.Struct('<II')
+_LENGTH = struct.Struct('<I')
+
+
+class Snapshot(object):
+    def __init__(self, mm):
+        self.mm = mm
+
+        magic, version, self.band_count, self.album_count = \
+            _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Invalid snapshot file')
+
+        self.bands_offset = _HEADER.size
+        self.albums_offset = self.bands_offset + self.band_count * _BAND.size
+
+    @classmethod
+    def load(cls, path):
+        """Memory-maps a snapshot, returns None if there's no usable one."""
+        if not os.path.isfile(path) or not os.path.getsize(path):
+            return
+
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            return cls(mm)
+        except (ValueError, struct.error) as e:
+            log.info('Ignoring snapshot %r: %s', path, e)
+            mm.close()
+
+    def _string(self, offset):
+        length, = _LENGTH.unpack_from(self.mm, offset)
+        offset += _LENGTH.size
+        return self.mm[offset:offset + length].decode('utf8')
+
+    def bands(self):
+        """Yields the index, name and uri of each band."""
+        for idx in xrange(self.band_count):
+            name, uri, _, _ = _BAND.unpack_from(
+                self.mm, self.bands_offset + idx * _BAND.size)
+            yield idx, self._string(name), self._string(uri)
+
+    def albums(self, idx):
+        """Returns a list of (name, uri) of the albums of a band, or None
+        if the albums of this band are not part of the snapshot."""
+        _, _, first, count = _BAND.unpack_from(
+            self.mm, self.bands_offset + idx * _BAND.size)
+        if count == UNKNOWN:
+            return
+
+        ret = []
+        for idx in xrange(first, first + count):
+            name, uri = _ALBUM.unpack_from(
+                self.mm, self.albums_offset + idx * _ALBUM.size)
+            ret.append((self._string(name), self._string(uri)))
+        return ret
+
+    def close(self):
+        self.mm.close()
+
+    @staticmethod
+    def write(path, bands, albums):
+        """Writes a snapshot given a list of (name, uri) bands and a dict
+        mapping band names to a list of (name, uri) albums."""
+        strings, offsets = [], {}
+        position = [0]
+
+        def string(value):
+            value = value.encode('utf8')
+            if value not in offsets:
+                offsets[value] = position[0]
+                strings.append(_LENGTH.pack(len(value)) + value)
+                position[0] += _LENGTH.size + len(value)
+            return offsets[value]
+
+        band_rows, album_rows = [], []
+        for name, uri in bands:
+            if name in albums:
+                first, count = len(album_rows), len(albums[name])
+                for album, album_uri in albums[name]:
+                    album_rows.append((string(album), string(album_uri)))
+            else:
+                first, count = 0, UNKNOWN
+
+            band_rows.append((string(name), string(uri), first, count))
+
+        strings_offset = _HEADER.size + len(band_rows) * _BAND.size + \
+            len(album_rows) * _ALBUM.size
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION,
+                                 len(band_rows), len(album_rows)))
+
+            for name, uri, first, count in band_rows:
+                f.write(_BAND.pack(name + strings_offset,
+                                   uri + strings_offset, first, count))
+
+            for name, uri in album_rows:
+                f.write(_ALBUM.pack(name + strings_offset,
+                                    uri + strings_offset))
+
+            f.write(''.join(strings))
+
+        # Replacing the file atomically keeps any existing memory-mapping
+        # of the previous snapshot intact.
+        os.rename(tmp_path, path)
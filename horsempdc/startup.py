@@ -0,0 +1,69 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+"""Measures where the time goes until the screen is drawn for the first
+time. Only the standard library modules sys and time are imported here, so
+that the imports of everything else can be measured."""
+
+import sys
+import time
+
+
+class StartupProfiler(object):
+    # Imports that took less than this many seconds are not reported.
+    THRESHOLD = 0.0001
+
+    def __init__(self):
+        self.start = time.time()
+        self.depth = 0
+
+        # The depth, name, and time including nested imports of each
+        # module that was imported for the first time, in import order.
+        self.imports = []
+
+        # The name and time since the start of each phase of the startup.
+        self.marks = []
+
+    def install(self):
+        """Hooks into the import statement."""
+        try:
+            import __builtin__ as builtins
+        except ImportError:
+            import builtins
+
+        original = builtins.__import__
+
+        def _import(name, *args, **kwargs):
+            if name in sys.modules:
+                return original(name, *args, **kwargs)
+
+            entry = [self.depth, name, None]
+            self.imports.append(entry)
+
+            self.depth += 1
+            start = time.time()
+            try:
+                return original(name, *args, **kwargs)
+            finally:
+                entry[2] = time.time() - start
+                self.depth -= 1
+
+        builtins.__import__ = _import
+
+    def mark(self, name):
+        self.marks.append((name, time.time() - self.start))
+
+    def report(self, f=sys.stdout):
+        f.write('Imports (cumulative, nested imports are indented):\n')
+        for depth, name, elapsed in self.imports:
+            if elapsed is not None and elapsed >= self.THRESHOLD:
+                f.write('%8.1fms  %s%s\n' % (elapsed * 1000,
+                                             '  ' * depth, name))
+
+        f.write('Startup:\n')
+        for name, elapsed in self.marks:
+            f.write('%8.1fms  %s\n' % (elapsed * 1000, name))
+
+
+profiler = StartupProfiler()
@@ -0,0 +1,154 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import base64
+import hashlib
+import os
+import socket
+import struct
+import urlparse
+
+_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xa
+
+
+class WebSocketException(Exception):
+    pass
+
+
+class WebSocket(object):
+    """Minimal RFC 6455 client, just enough to receive the JSON events that
+    Mopidy pushes to its clients."""
+
+    def __init__(self, url, timeout=None):
+        self.url = url
+        self.timeout = timeout
+        self.sock = None
+        self.rfile = None
+
+    def connect(self):
+        url = urlparse.urlparse(self.url)
+        port = url.port or (443 if url.scheme == 'wss' else 80)
+        if url.scheme != 'ws':
+            raise WebSocketException('Unsupported scheme: %s' % url.scheme)
+
+        self.sock = socket.create_connection((url.hostname, port),
+                                             self.timeout)
+        self.rfile = self.sock.makefile('rb')
+
+        key = base64.b64encode(os.urandom(16))
+        self.sock.sendall('\r\n'.join([
+            'GET %s HTTP/1.1' % (url.path or '/'),
+            'Host: %s:%d' % (url.hostname, port),
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            'Sec-WebSocket-Key: %s' % key,
+            'Sec-WebSocket-Version: 13',
+            '', '',
+        ]))
+
+        status = self.rfile.readline()
+        if status.split()[1:2] != ['101']:
+            raise WebSocketException('Handshake failed: %r' % status)
+
+        headers = {}
+        while True:
+            line = self.rfile.readline().strip()
+            if not line:
+                break
+
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(hashlib.sha1(key + _GUID).digest())
+        if headers.get('sec-websocket-accept') != accept:
+            raise WebSocketException('Invalid Sec-WebSocket-Accept header')
+
+    def _read(self, length):
+        data = self.rfile.read(length)
+        if len(data) != length:
+            raise WebSocketException('Connection closed')
+        return data
+
+    def _send_frame(self, opcode, payload):
+        header = chr(0x80 | opcode)
+
+        # Frames sent by a client have to be masked.
+        if len(payload) < 126:
+            header += chr(0x80 | len(payload))
+        elif len(payload) < 0x10000:
+            header += chr(0x80 | 126) + struct.pack('!H', len(payload))
+        else:
+            header += chr(0x80 | 127) + struct.pack('!Q', len(payload))
+
+        mask = bytearray(os.urandom(4))
+        data = bytearray(payload)
+        for idx in xrange(len(data)):
+            data[idx] ^= mask[idx % 4]
+
+        self.sock.sendall(header + str(mask) + str(data))
+
+    def _recv_frame(self):
+        first, second = bytearray(self._read(2))
+        fin, opcode = first & 0x80, first & 0x0f
+
+        length = second & 0x7f
+        if length == 126:
+            length, = struct.unpack('!H', self._read(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', self._read(8))
+
+        mask = bytearray(self._read(4)) if second & 0x80 else None
+        payload = self._read(length)
+
+        if mask:
+            data = bytearray(payload)
+            for idx in xrange(len(data)):
+                data[idx] ^= mask[idx % 4]
+            payload = str(data)
+
+        return fin, opcode, payload
+
+    def send(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf8')
+        self._send_frame(OP_TEXT, text)
+
+    def recv(self):
+        """Returns the next text or binary message, or None once the
+        server closes the connection."""
+        message = []
+        while True:
+            fin, opcode, payload = self._recv_frame()
+
+            if opcode == OP_PING:
+                self._send_frame(OP_PONG, payload)
+            elif opcode == OP_PONG:
+                pass
+            elif opcode == OP_CLOSE:
+                self.close()
+                return
+            else:
+                message.append(payload)
+                if fin:
+                    return ''.join(message)
+
+    def close(self):
+        if not self.sock:
+            return
+
+        try:
+            self._send_frame(OP_CLOSE, '')
+        except socket.error:
+            pass
+
+        self.rfile.close()
+        self.sock.close()
+        self.sock = self.rfile = None
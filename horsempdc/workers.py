@@ -0,0 +1,149 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import collections
+import logging
+import Queue
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Job(object):
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+        self.result = None
+        self.error = None
+        self.started = False
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def cancel(self):
+        """Cancels this job if it has not been picked up by a worker yet."""
+        self.cancelled = True
+
+    def run(self):
+        self.started = True
+        if self.cancelled:
+            self.done.set()
+            return
+
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            log.exception('Error running background job')
+            self.error = e
+
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """Waits for the job to finish and returns its result."""
+        self.done.wait(timeout)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class WorkerPool(object):
+    """Fixed amount of daemon threads processing jobs from a queue. The
+    amount of workers is also the limit on in-flight requests."""
+
+    def __init__(self, workers=4, maxsize=0):
+        self.queue = Queue.Queue(maxsize)
+        self.threads = []
+
+        for _ in xrange(workers):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+
+            job.run()
+
+    def submit(self, func, *args, **kwargs):
+        """Queues a job. Raises Queue.Full if the queue is bounded and
+        already full, rather than blocking the caller."""
+        job = Job(func, args, kwargs)
+        self.queue.put(job, block=False)
+        return job
+
+    def imap(self, func, items):
+        """Runs func for each item and yields the results in order. A
+        result is no longer referenced once it has been yielded, so that
+        it can be freed while later results are still being fetched."""
+        jobs = collections.deque()
+        for item in items:
+            job = Job(func, (item,), {})
+            self.queue.put(job)
+            jobs.append(job)
+
+        while jobs:
+            yield jobs.popleft().wait()
+
+    def map(self, func, items):
+        """Runs func for each item and returns the results in order."""
+        return list(self.imap(func, items))
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key. Only the first call
+    actually runs, any others that come in while it's running wait for it
+    and share its result or exception."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+        # Amount of calls that shared the result of another call.
+        self.coalesced = 0
+
+    def join(self, key):
+        """Returns the job of the call with this key that is running
+        already and False, or a new job and True, in which case the caller
+        runs the call itself and has to finish() the job afterwards."""
+        with self.lock:
+            job = self.jobs.get(key)
+            if job:
+                self.coalesced += 1
+                return job, False
+
+            job = self.jobs[key] = Job(None, (), {})
+            return job, True
+
+    def finish(self, key, job, result=None, error=None):
+        """Hands the result or exception of a call over to any calls that
+        joined it."""
+        job.result = result
+        job.error = error
+
+        with self.lock:
+            del self.jobs[key]
+        job.done.set()
+
+    def run(self, key, func, *args, **kwargs):
+        job, leader = self.join(key)
+        if not leader:
+            return job.wait()
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.finish(key, job, error=e)
+            raise
+
+        self.finish(key, job, result)
+        return result
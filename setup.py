@@ -25,9 +25,6 @@ setup(
     description='Horse interface for MPD daemons such as Mopidy.',
     include_package_data=True,
     install_requires=[
-        # Required on BSD systems for unknown reasons.
-        'jinja2',
-
         # Required for interaction with MPD daemons.
         'requests',
         'requests-toolbelt',
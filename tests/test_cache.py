@@ -0,0 +1,113 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import unittest
+
+from horsempdc.cache import Cache
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = Cache(100)
+        self.evicted = []
+        self.view = self.cache.view('albums', len,
+                                    on_evict=self.evicted.append)
+        self.other = self.cache.view('tracks', len, ttl=60)
+
+    def expire(self):
+        for key, entry in self.cache.entries.items():
+            if entry[2] is not None:
+                self.cache.entries[key] = entry[0], entry[1], 0
+
+    def test_dict(self):
+        self.view['a'] = 'x' * 10
+        self.assertIn('a', self.view)
+        self.assertEqual(self.view['a'], 'x' * 10)
+        self.assertEqual(self.view.get('a'), 'x' * 10)
+        self.assertEqual(self.view.get('b', 'default'), 'default')
+        self.assertRaises(KeyError, lambda: self.view['b'])
+        self.assertEqual(list(self.view), ['a'])
+        self.assertEqual(len(self.view), 1)
+        self.assertEqual(len(self.other), 0)
+        self.assertEqual(self.cache.size, 10)
+
+        self.view['a'] = 'x' * 20
+        self.assertEqual(self.cache.size, 20)
+
+        self.assertEqual(self.view.pop('a'), 'x' * 20)
+        self.assertEqual(self.view.pop('a', 'default'), 'default')
+        self.assertEqual(self.cache.size, 0)
+        self.assertEqual(self.evicted, [])
+
+    def test_lru(self):
+        for name in 'abcd':
+            self.view[name] = name * 30
+
+        # The least recently added entry doesn't fit anymore.
+        self.assertEqual(sorted(self.view), ['b', 'c', 'd'])
+        self.assertEqual(self.evicted, ['a'])
+
+        # Using an entry makes it the most recently used one, looking it up
+        # through get() or "in" doesn't.
+        self.view['b']
+        self.view.get('c')
+        self.assertIn('c', self.view)
+        self.view['e'] = 'e' * 30
+        self.assertEqual(sorted(self.view), ['b', 'd', 'e'])
+        self.assertEqual(self.evicted, ['a', 'c'])
+
+    def test_too_large(self):
+        self.view['a'] = 'a' * 10
+        self.view['b'] = 'b' * 200
+        self.assertEqual(list(self.view), ['b'])
+        self.assertEqual(self.cache.size, 200)
+
+    def test_shared_budget(self):
+        self.view['a'] = 'a' * 60
+        self.other['a'] = 'b' * 60
+        self.assertEqual(list(self.view), [])
+        self.assertEqual(list(self.other), ['a'])
+        self.assertEqual(self.evicted, ['a'])
+
+    def test_ttl(self):
+        self.other['a'] = 'a'
+        self.view['a'] = 'a'
+        self.expire()
+
+        self.assertEqual(list(self.other), [])
+        self.assertNotIn('a', self.other)
+        self.assertEqual(self.other.get('a'), None)
+        self.assertEqual(list(self.view), ['a'])
+        self.assertEqual(self.cache.size, 1)
+
+    def test_expired_notified_later(self):
+        view = self.cache.view('albums', len, ttl=60,
+                               on_evict=self.evicted.append)
+        view['a'] = 'a'
+        view['b'] = 'b'
+        self.expire()
+
+        # Looking up an expired entry doesn't invoke any listeners, as the
+        # caller may be holding a lock that the listeners need as well.
+        self.assertIsNone(view.get('a'))
+        self.assertNotIn('b', view)
+        self.assertEqual(self.evicted, [])
+
+        view['c'] = 'c'
+        self.assertEqual(self.evicted, ['a', 'b'])
+
+        view['d'] = 'd'
+        self.assertEqual(self.evicted, ['a', 'b'])
+
+    def test_clear(self):
+        self.view['a'] = 'a'
+        self.other['a'] = 'a'
+        self.view.clear()
+        self.assertEqual(list(self.view), [])
+        self.assertEqual(list(self.other), ['a'])
+        self.assertEqual(self.cache.size, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
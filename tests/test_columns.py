@@ -0,0 +1,214 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import collections
+import curses
+import threading
+import unittest
+
+from bench import render
+from horsempdc.abstract import Column
+from horsempdc.columns import AlbumsColumn, TracksColumn, _duration
+from horsempdc.ebola import Curse
+
+
+class FakeScreenTestCase(unittest.TestCase):
+    """Draws to the fake screen of the render benchmark rather than to the
+    terminal."""
+
+    def setUp(self):
+        self.curses = dict(vars(curses))
+        self.addCleanup(self._restore)
+
+        self.screen = render.FakeScreen(40, 120)
+        render.install(self.screen)
+
+    def _restore(self):
+        for name in set(vars(curses)) - set(self.curses):
+            delattr(curses, name)
+        vars(curses).update(self.curses)
+
+    def place(self, column, height=20):
+        column.x, column.y, column.width, column.height = 0, 0, 40, height
+        column.prepare()
+        column.render()
+        column.highlight()
+
+
+class TestColumnCache(unittest.TestCase):
+    def setUp(self):
+        # Only the cache of columns is used, which doesn't need a screen.
+        self.curse = Curse.__new__(Curse)
+        self.curse.column_cache = collections.OrderedDict()
+
+        self.albums = ['Album %d' % idx for idx in xrange(10)]
+
+    def column(self, albums):
+        return self.curse.column(('albums', 'Band'), albums,
+                                 lambda albums: AlbumsColumn('Band', albums))
+
+    def test_reused(self):
+        column = self.column(self.albums)
+        self.assertIs(self.column(self.albums), column)
+        self.assertIsNot(self.column(list(self.albums)), column)
+
+    def test_filter_dropped(self):
+        column = self.column(self.albums)
+        column.filter(u'album 3')
+        column.index = 0
+        self.assertEqual(column.lines, ['Album 3'])
+
+        self.assertIs(self.column(self.albums), column)
+        self.assertIs(column.lines, self.albums)
+        self.assertEqual(column.length, 10)
+        self.assertEqual(column.index, 0)
+
+    def test_index_kept(self):
+        column = self.column(self.albums)
+        column.index = column.offset = 7
+
+        self.column(self.albums)
+        self.assertEqual(column.index, 7)
+
+    def test_index_clamped(self):
+        column = self.column(self.albums)
+        column.index = column.offset = 9
+
+        del self.albums[4:]
+        self.column(self.albums)
+        self.assertEqual(column.length, 4)
+        self.assertEqual(column.index, 3)
+        self.assertEqual(column.offset, 3)
+
+        del self.albums[:]
+        self.column(self.albums)
+        self.assertEqual(column.index, 0)
+
+
+class TestGrow(FakeScreenTestCase):
+    def test_grow(self):
+        lines = [u'Band %d' % idx for idx in xrange(10)]
+        column = Column('bands')
+        column.populate(lines)
+        self.place(column)
+
+        # Once the pad is as large as it gets, growing the list doesn't
+        # change its size, but the current line can still be highlighted.
+        for _ in xrange(3):
+            lines.extend(u'Band %d' % idx
+                         for idx in xrange(len(lines), len(lines) + 500))
+            column.grow()
+            column.highlight()
+            column.scroll(1)
+
+        self.assertEqual(column.length, 1510)
+        self.assertEqual(column.index, 3)
+
+    def test_filter(self):
+        lines = [u'Band %d' % idx for idx in xrange(10)]
+        column = Column('bands')
+        column.populate(lines)
+        self.place(column)
+
+        column.filter(u'and 1')
+        self.assertEqual(column.lines, [u'Band 1'])
+
+        # Lines received after the list was filtered are searched as well.
+        lines.extend(u'Band %d' % idx for idx in xrange(10, 20))
+        column.grow()
+        column.filter(u'and 1')
+        self.assertEqual(column.lines, [u'Band 1'] + lines[10:])
+
+        column.restore()
+        self.assertEqual(column.length, 20)
+
+
+class FakeLoop(object):
+    def __init__(self):
+        self.calls = []
+
+    def call_soon_threadsafe(self, func, *args):
+        self.calls.append((func, args))
+
+
+class FakeMPD(object):
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.lookups = []
+        self.lock = threading.Lock()
+
+    def track_details(self, band, album, start, end):
+        with self.lock:
+            self.lookups.append(start)
+            if start in self.fail:
+                self.fail.remove(start)
+                raise ValueError('Lookup failed')
+        return [(idx + 1, 60 * idx) for idx in xrange(start, min(end, 120))]
+
+
+class FakeCurse(object):
+    def __init__(self, mpd):
+        self.mpd = mpd
+        self.loop = FakeLoop()
+
+
+class TestTracksColumn(FakeScreenTestCase):
+    def setUp(self):
+        FakeScreenTestCase.setUp(self)
+        self.tracks = tuple(u'Track %d' % idx for idx in xrange(120))
+        self.column = TracksColumn('Band', 'Album', self.tracks)
+
+    def load(self, curse):
+        self.column.load(curse)
+        self.column.loader.join(5)
+
+        for func, args in curse.loop.calls:
+            func(*args)
+        del curse.loop.calls[:]
+
+    def test_duration(self):
+        self.assertEqual(_duration(None), '')
+        self.assertEqual(_duration(0), '0:00')
+        self.assertEqual(_duration(59), '0:59')
+        self.assertEqual(_duration(61), '1:01')
+        self.assertEqual(_duration(3600), '1:00:00')
+        self.assertEqual(_duration(3725), '1:02:05')
+
+    def test_next_page(self):
+        self.assertEqual(len(self.column.pages), 3)
+
+        # The visible page comes first, then the ones following it.
+        self.column.offset = 60
+        self.assertEqual([self.column._next_page() for _ in xrange(4)],
+                         [1, 2, 0, None])
+
+    def test_load(self):
+        curse = FakeCurse(FakeMPD())
+        self.load(curse)
+
+        self.assertEqual(curse.mpd.lookups, [0, 50, 100])
+        self.assertEqual(self.column.all_lines[0], u'  1  0:00  Track 0')
+        self.assertEqual(self.column.all_lines[10], u' 11 10:00  Track 10')
+
+    def test_load_failed(self):
+        curse = FakeCurse(FakeMPD(fail=[50]))
+        self.load(curse)
+        self.assertEqual(self.column.pages, [True, False, False])
+
+        # The page that failed is looked up once more next time.
+        self.load(curse)
+        self.assertEqual(self.column.pages, [True, True, True])
+        self.assertEqual(curse.mpd.lookups, [0, 50, 50, 100])
+
+    def test_loaded_rendered(self):
+        self.place(self.column)
+        self.column._loaded(0, [(1, 60)])
+
+        # The current line can be highlighted before the next frame.
+        self.column.highlight()
+        self.assertEqual(self.column.pad_top, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
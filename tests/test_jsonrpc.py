@@ -0,0 +1,311 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import json
+import threading
+import time
+import unittest
+
+from bench import fakemopidy
+from horsempdc.jsonrpc import CircuitBreaker, JsonRPC, _iter_result
+from horsempdc.jsonrpc import RPCConnectionError, RPCException, RPCUnavailable
+from horsempdc.jsonrpc import RPCTimeout
+
+RESULTS = [
+    [],
+    [1, 5.25, -3e-2, 12345678901234567890, True, False, None],
+    [u'B\xe4nd \u2603', 'a "quoted" \\ string', {'nested': [1, {'x': 2.5}]}],
+    [{'name': 'Track %d' % idx, 'uri': 'local:track:%d' % idx}
+     for idx in xrange(20)],
+    5.25,
+    -1e+10,
+    12,
+    u'\u2603',
+    None,
+    {'uri': 'local:track:1'},
+]
+
+
+def _response(result, separators=(', ', ': ')):
+    return json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': result},
+                      separators=separators)
+
+
+class TestStream(unittest.TestCase):
+    def assertDecodes(self, result, chunks):
+        expected = json.loads(json.dumps(result))
+        if isinstance(expected, list):
+            self.assertEqual(list(_iter_result(chunks)), expected)
+        else:
+            self.assertEqual(list(_iter_result(chunks)), [expected])
+
+    def test_whole(self):
+        for result in RESULTS:
+            self.assertDecodes(result, [_response(result)])
+
+    def test_one_byte_at_a_time(self):
+        for separators in ((', ', ': '), (',', ':')):
+            for result in RESULTS:
+                data = _response(result, separators)
+                self.assertDecodes(result, [ch for ch in data])
+
+    def test_every_split(self):
+        for result in RESULTS:
+            data = _response(result, (',', ':'))
+            for idx in xrange(len(data) + 1):
+                self.assertDecodes(result, [data[:idx], data[idx:]])
+
+    def test_number_at_chunk_boundary(self):
+        self.assertEqual(list(_iter_result(['{"result": 5.', '25}'])),
+                         [5.25])
+        self.assertEqual(list(_iter_result(['{"result": [1, 2', 'e3]}'])),
+                         [1, 2000.0])
+
+    def test_error(self):
+        data = json.dumps({'jsonrpc': '2.0', 'id': 1, 'error': {
+            'code': -32601, 'message': 'Method not found'}})
+        self.assertRaises(RPCException, list, _iter_result([data]))
+
+    def test_truncated(self):
+        data = _response([1, 2, 3])
+        for idx in xrange(len(data) - 1):
+            self.assertRaises(ValueError, list, _iter_result([data[:idx]]))
+
+    def test_invalid(self):
+        for data in ('{"result": [1 2]}', '{"result": [1, 5.x]}',
+                     '{"result": 5.x}', '{"result": [1, 2'):
+            self.assertRaises(ValueError, list, _iter_result([data]))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens(self):
+        breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+        for _ in xrange(2):
+            breaker.failure()
+            self.assertTrue(breaker.allow())
+
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+
+    def test_half_open(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=60)
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+
+        # Once the timeout has passed one request is let through, and the
+        # others keep failing until it's known how that one went.
+        breaker.opened -= 60
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+
+        breaker.opened -= 60
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+
+class TestSend(unittest.TestCase):
+    def setUp(self):
+        self.rpc = JsonRPC('http://127.0.0.1:1/mopidy/rpc')
+        self.rpc.BACKOFF = 0
+        self.calls = 0
+
+    def fail(self):
+        self.calls += 1
+        raise RPCConnectionError('Connection refused')
+
+    def test_retries(self):
+        self.assertRaises(RPCConnectionError, self.rpc._send, self.fail, True)
+        self.assertEqual(self.calls, self.rpc.RETRIES + 1)
+
+        # All attempts of one call count as a single failure.
+        self.assertEqual(self.rpc.breaker.failures, 1)
+
+    def test_not_idempotent(self):
+        self.assertRaises(RPCConnectionError, self.rpc._send, self.fail,
+                          False)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.rpc.breaker.failures, 1)
+
+    def test_interactive(self):
+        with self.rpc.interactive():
+            self.assertRaises(RPCConnectionError, self.rpc._send, self.fail,
+                              True)
+        self.assertEqual(self.calls, 1)
+
+    def test_retry_succeeds(self):
+        def send():
+            self.calls += 1
+            if self.calls == 1:
+                raise RPCConnectionError('Connection reset')
+            return 'result'
+
+        self.assertEqual(self.rpc._send(send, True), 'result')
+        self.assertEqual(self.rpc.breaker.failures, 0)
+
+    def test_fails_fast(self):
+        for _ in xrange(self.rpc.breaker.threshold):
+            self.assertRaises(RPCConnectionError, self.rpc._send, self.fail,
+                              True)
+
+        calls = self.calls
+        self.assertRaises(RPCUnavailable, self.rpc._send, self.fail, True)
+        self.assertEqual(self.calls, calls)
+
+    def test_refused(self):
+        self.rpc.RETRIES = 0
+        start = time.time()
+        self.assertRaises(RPCConnectionError, self.rpc.query,
+                          'core.library.browse', uri=None)
+        self.assertLess(time.time() - start, 5)
+
+
+class TestCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.server = fakemopidy.start(bands=3, albums=2, tracks=2,
+                                       latency=0.2)
+        self.rpc = JsonRPC('http://%s/mopidy/rpc' % self.server.host)
+
+        # The calls of each batch that is actually sent.
+        self.batches = []
+        batch = self.rpc._batch
+
+        def record(calls):
+            self.batches.append(calls)
+            return batch(calls)
+
+        self.rpc._batch = record
+
+    def tearDown(self):
+        self.rpc.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def browse(self, band):
+        return 'core.library.browse', {'uri': 'local:directory?band=%d' % band}
+
+    def in_flight(self, func, *args):
+        """Runs func in another thread, until the call it makes is in
+        flight, and returns a list that holds its result later on."""
+        result = []
+        t = threading.Thread(target=lambda: result.append(func(*args)))
+        t.start()
+        self.addCleanup(t.join, 5)
+
+        while not self.rpc.flights.jobs:
+            time.sleep(0.001)
+        return t, result
+
+    def test_batch_joins_query(self):
+        method, params = self.browse(0)
+        t, result = self.in_flight(lambda: self.rpc.query(method, **params))
+
+        rows = self.rpc.query_many([self.browse(0), self.browse(1)])
+        t.join(5)
+
+        self.assertEqual(rows[0], result[0])
+        self.assertEqual(len(rows[1]), 2)
+        self.assertEqual(self.batches, [[self.browse(1)]])
+        self.assertEqual(self.rpc.flights.coalesced, 1)
+
+    def test_query_joins_batch(self):
+        t, result = self.in_flight(self.rpc.query_many,
+                                   [self.browse(0), self.browse(1)])
+
+        method, params = self.browse(1)
+        rows = self.rpc.query(method, **params)
+        t.join(5)
+
+        self.assertEqual(rows, result[0][1])
+        self.assertEqual(self.server.requests, 1)
+
+    def test_batch_joins_batch(self):
+        t, result = self.in_flight(self.rpc.query_many, [self.browse(0)])
+
+        rows = self.rpc.query_many([self.browse(0), self.browse(0),
+                                    self.browse(2)])
+        t.join(5)
+
+        self.assertEqual(rows[0], result[0][0])
+        self.assertEqual(rows[1], result[0][0])
+        self.assertEqual(self.batches, [[self.browse(0)], [self.browse(2)]])
+
+    def test_errors_shared(self):
+        call = 'core.library.browse', {'uri': 'local:directory?band=x'}
+        t, result = self.in_flight(self.rpc.query_many, [call])
+
+        self.assertRaises(RPCException, self.rpc.query, call[0], **call[1])
+        rows = self.rpc.query_many([call])
+        t.join(5)
+
+        self.assertIsInstance(result[0][0], RPCException)
+        self.assertIsInstance(rows[0], RPCException)
+        self.assertEqual(self.rpc.flights.jobs, {})
+
+    def test_not_idempotent(self):
+        call = 'core.tracklist.add', {'uris': ['local:track:0:0:0']}
+        self.rpc.query_many([call, call])
+        self.assertEqual(self.batches, [[call, call]])
+
+
+class TestInteractive(unittest.TestCase):
+    def setUp(self):
+        self.server = fakemopidy.start(bands=3, albums=2, tracks=2,
+                                       latency=1)
+        self.rpc = JsonRPC('http://%s/mopidy/rpc' % self.server.host)
+        self.rpc.INTERACTIVE_TIMEOUT = 0.2
+
+    def tearDown(self):
+        self.rpc.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def browse(self):
+        return self.rpc.query('core.library.browse',
+                              uri='local:directory?band=0')
+
+    def test_timeout(self):
+        start = time.time()
+        with self.rpc.interactive():
+            self.assertRaises(RPCTimeout, self.browse)
+
+        # The request is given up on rather than retried.
+        self.assertLess(time.time() - start, 0.9)
+        self.assertEqual(self.rpc.requests, 1)
+
+        self.assertEqual(len(self.browse()), 2)
+
+    def test_in_flight(self):
+        result = []
+        t = threading.Thread(target=lambda: result.append(self.browse()))
+        t.start()
+        self.addCleanup(t.join, 5)
+
+        while not self.rpc.flights.jobs:
+            time.sleep(0.001)
+
+        # Nor is the user kept waiting on the same call by another thread.
+        start = time.time()
+        with self.rpc.interactive():
+            self.assertRaises(RPCTimeout, self.browse)
+        self.assertLess(time.time() - start, 0.9)
+
+        t.join(5)
+        self.assertEqual(len(result[0]), 2)
+        self.assertEqual(self.rpc.requests, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
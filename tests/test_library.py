@@ -0,0 +1,58 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import unittest
+
+from horsempdc.library import Names, URIs
+
+
+class TestNames(unittest.TestCase):
+    def test_intern(self):
+        names = Names()
+        a = names(u''.join([u'Intro']))
+        b = names(u''.join([u'Intr', u'o']))
+        self.assertEqual(a, u'Intro')
+        self.assertIs(a, b)
+
+
+class TestURIs(unittest.TestCase):
+    def setUp(self):
+        self.uris = URIs()
+
+    def roundtrip(self, uri):
+        packed = self.uris.pack(uri)
+        self.assertIsInstance(packed, str)
+        self.assertEqual(self.uris.unpack(packed), uri)
+        return packed
+
+    def test_no_separator(self):
+        self.roundtrip(u'')
+        self.roundtrip(u'track.mp3')
+        self.assertEqual(self.uris.prefixes, [''])
+
+    def test_non_ascii(self):
+        self.roundtrip(u'local:artist:Mot\xf6rhead')
+        self.roundtrip(u'local:track:\u2660/Bj\xf6rk \u6c34.mp3')
+        self.roundtrip(u'Sigur R\xf3s/\xc1g\xe6tis byrjun')
+
+    def test_shared_prefix(self):
+        a = self.roundtrip(u'file:///music/Band/Album/1.mp3')
+        b = self.roundtrip(u'file:///music/Band/Album/2.mp3')
+        c = self.roundtrip(u'file:///music/Band/Other/1.mp3')
+
+        # URIs with the same prefix are stored as the index of the prefix
+        # and their remainder only.
+        self.assertEqual(a[:4], b[:4])
+        self.assertNotEqual(a[:4], c[:4])
+        self.assertEqual(a[4:], '1.mp3')
+        self.assertEqual(self.uris.prefixes, [
+            'file:///music/Band/Album/', 'file:///music/Band/Other/'])
+
+    def test_query_string(self):
+        self.roundtrip(u'spotify:search?q=a&type=artist')
+        self.roundtrip(u'http://host/stream?id=')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from bench import fakemopidy, fakews
+from horsempdc.exceptions import AngryHorseException
+from horsempdc.jsonrpc import RPCException
+from horsempdc.mpd.mopidy import MopidyClient
+from horsempdc.snapshot import Snapshot
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.threads = threading.active_count()
+        self.rpc = fakemopidy.start(bands=2, albums=2, tracks=2)
+        self.ws = fakews.start()
+
+        self.mpd = MopidyClient(self.rpc.host)
+        self.mpd.events_url = self.ws.url
+        self.mpd.RECONNECT_DELAY = 0
+
+        self.events = Queue.Queue()
+        self.mpd.on('tracklist_changed', self.events.put)
+        self.conns = []
+
+    def tearDown(self):
+        # Closing the connections lets the listener thread notice that it
+        # has to stop.
+        self.mpd.listening = False
+        for conn in self.conns:
+            conn.close()
+        self.mpd.jsonrpc.close()
+
+        for server in (self.ws, self.rpc):
+            server.shutdown()
+            server.server_close()
+
+        # Rather than having them interrupted while the interpreter exits,
+        # the listener and server threads are given the time to finish.
+        deadline = time.time() + 5
+        while threading.active_count() > self.threads and \
+                time.time() < deadline:
+            time.sleep(0.01)
+
+    def accept(self):
+        conn = self.ws.accept()
+        self.conns.append(conn)
+        return conn
+
+    def test_tracklist_fetched_on_connect(self):
+        self.mpd.listen()
+        conn = self.accept()
+
+        self.assertEqual(self.events.get(timeout=5), {})
+        self.assertEqual(self.mpd.tracklist(), [])
+
+    def test_tracklist_fetched_on_reconnect(self):
+        self.mpd.listen()
+        conn = self.accept()
+        self.events.get(timeout=5)
+
+        self.mpd._tracklist = ['stale']
+        conn.close()
+
+        conn = self.accept()
+        self.events.get(timeout=5)
+        self.assertIsNone(self.mpd._tracklist)
+
+    def test_events(self):
+        self.mpd.listen()
+        conn = self.accept()
+        self.events.get(timeout=5)
+
+        conn.send('{"event": "tracklist_changed"}')
+        self.assertEqual(self.events.get(timeout=5),
+                         {'event': 'tracklist_changed'})
+
+
+class TestCrawl(unittest.TestCase):
+    def setUp(self):
+        self.rpc = fakemopidy.start(bands=3, albums=2, tracks=2)
+        self.mpd = MopidyClient(self.rpc.host)
+
+        # Browsing the second band and its albums fails.
+        browse = self.rpc.library.browse
+
+        def failing(uri):
+            if 'band=1' in uri:
+                raise ValueError('Broken directory')
+            return browse(uri)
+
+        self.rpc.library.browse = failing
+
+    def tearDown(self):
+        self.mpd.jsonrpc.close()
+        self.rpc.shutdown()
+        self.rpc.server_close()
+
+    def test_failures_not_cached(self):
+        self.mpd.crawl(concurrency=2)
+
+        self.assertEqual(sorted(self.mpd._albums), ['Band 0', 'Band 2'])
+        self.assertEqual(len(list(self.mpd._tracks)), 4)
+
+        # The band is browsed once more when it's requested.
+        self.assertRaises(RPCException, self.mpd.albums, 'Band 1')
+
+
+class TestTracks(unittest.TestCase):
+    def setUp(self):
+        self.rpc = fakemopidy.start(bands=2, albums=2, tracks=3)
+        self.mpd = MopidyClient(self.rpc.host)
+        self.mpd.bands()
+
+    def tearDown(self):
+        self.mpd.jsonrpc.close()
+        self.rpc.shutdown()
+        self.rpc.server_close()
+
+    def test_tracks(self):
+        self.assertEqual(self.mpd.tracks('Band 1', 'Album 0'),
+                         ('Track 0', 'Track 1', 'Track 2'))
+
+    def test_lookup(self):
+        self.assertEqual(self.mpd.lookup(['local:track:1:0:0',
+                                          'local:track:1:0:2']), {
+            'local:track:1:0:0': (1, 180),
+            'local:track:1:0:2': (3, 182),
+        })
+
+    def test_track_details(self):
+        self.assertEqual(self.mpd.track_details('Band 0', 'Album 1', 1, 5),
+                         [(2, 181), (3, 182)])
+
+        # Details that are known already aren't looked up once more.
+        requests = self.rpc.requests
+        self.assertEqual(self.mpd.track_details('Band 0', 'Album 1', 0, 3),
+                         [(1, 180), (2, 181), (3, 182)])
+        self.assertEqual(self.rpc.requests, requests + 1)
+        self.mpd.track_details('Band 0', 'Album 1', 0, 3)
+        self.assertEqual(self.rpc.requests, requests + 1)
+
+
+class TestExpiry(unittest.TestCase):
+    def setUp(self):
+        self.rpc = fakemopidy.start(bands=20, albums=2, tracks=2)
+        self.mpd = MopidyClient(self.rpc.host)
+
+    def tearDown(self):
+        self.mpd.jsonrpc.close()
+        self.rpc.shutdown()
+        self.rpc.server_close()
+
+    def expire(self):
+        entries = self.mpd.cache.entries
+        for key, entry in entries.items():
+            entries[key] = entry[0], entry[1], 0
+
+    def run_briefly(self, func, *args):
+        t = threading.Thread(target=func, args=args)
+        t.daemon = True
+        t.start()
+        t.join(5)
+        self.assertFalse(t.is_alive(), 'Deadlocked')
+
+    def test_sort_by_albums(self):
+        bands = self.mpd.bands()
+        self.mpd.albums_many(bands[:10])
+        self.expire()
+
+        # Sorting calls the cache while holding the lock of the sorted
+        # views, which expired albums must not try to take as well.
+        self.mpd.band_order = 'albums'
+        self.run_briefly(self.mpd.bands)
+        self.assertEqual(sorted(self.mpd.bands()), sorted(bands))
+
+        self.run_briefly(self.mpd.albums, bands[0])
+        self.assertEqual(self.mpd.albums(bands[0]), ['Album 0', 'Album 1'])
+        self.assertEqual(self.mpd.bands()[0], bands[0])
+
+    def fail_browsing(self):
+        def browse(uri):
+            raise ValueError('Broken library')
+
+        self.rpc.library.browse = browse
+
+    def test_refresh(self):
+        self.assertEqual(len(self.mpd.bands()), 20)
+        self.assertFalse(self.mpd.bands_stale())
+
+        self.rpc.library.bands = 25
+        self.mpd._bands_expire = 0
+        self.assertTrue(self.mpd.bands_stale())
+
+        # The bands that are known keep being used until all of them have
+        # been fetched once more.
+        bands = self.mpd._bands
+        fetched = self.mpd.fetch_bands()
+        for _ in xrange(10):
+            next(fetched)
+        self.assertIs(self.mpd._bands, bands)
+
+        self.assertEqual(len(list(fetched)), 15)
+        self.assertEqual(len(self.mpd._bands), 25)
+        self.assertEqual(len(self.mpd.bands()), 25)
+        self.assertFalse(self.mpd.bands_stale())
+
+    def test_refresh_failed(self):
+        bands = self.mpd.bands()
+        self.mpd._bands_expire = 0
+        self.fail_browsing()
+
+        self.assertRaises(RPCException, list, self.mpd.fetch_bands())
+        self.assertTrue(self.mpd.bands_stale())
+        self.assertEqual(sorted(self.mpd._bands), sorted(bands))
+
+    def test_load_failed(self):
+        self.fail_browsing()
+        self.assertRaises(RPCException, self.mpd.bands)
+        self.assertEqual(self.mpd._bands, {})
+        self.assertFalse(self.mpd.bands_stale())
+
+    def test_invalidate(self):
+        bands = self.mpd.bands()
+        self.mpd.albums_many(bands[:2])
+
+        self.mpd.invalidate(bands[0])
+        self.assertNotIn(bands[0], self.mpd._albums)
+        self.assertIn(bands[1], self.mpd._albums)
+        self.assertFalse(self.mpd.bands_stale())
+
+        self.mpd.invalidate()
+        self.assertEqual(list(self.mpd._albums), [])
+        self.assertTrue(self.mpd.bands_stale())
+        self.assertEqual(self.mpd.bands(), bands)
+
+
+class SnapshotClient(MopidyClient):
+    path = None
+
+    @property
+    def snapshot_path(self):
+        return self.path
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.rpc = fakemopidy.start(bands=3, albums=2, tracks=2)
+        self.mpd = SnapshotClient(self.rpc.host)
+
+        self.dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirpath)
+        self.mpd.path = os.path.join(self.dirpath, 'library.snapshot')
+
+    def tearDown(self):
+        self.mpd.jsonrpc.close()
+        self.rpc.shutdown()
+        self.rpc.server_close()
+
+    def test_removed_band(self):
+        bands = [('Band %d' % idx, 'local:directory?band=%d' % idx)
+                 for idx in xrange(3)]
+        Snapshot.write(self.mpd.path, bands + [('Gone', 'local:gone')], {
+            'Band 0': [('Album 0', 'local:directory?band=0&album=0')],
+        })
+
+        self.assertTrue(self.mpd.load_snapshot())
+        self.assertEqual(self.mpd.bands(), ['Band 0', 'Band 1', 'Band 2',
+                                            'Gone'])
+        self.assertEqual(self.mpd.albums('Band 0'), ['Album 0'])
+
+        self.assertTrue(self.mpd.revalidate())
+        self.assertEqual(self.mpd.bands(), ['Band 0', 'Band 1', 'Band 2'])
+        self.assertEqual(self.mpd.albums('Band 0'), ['Album 0', 'Album 1'])
+
+        # A band that is still shown, but no longer known, can't be opened.
+        self.assertRaises(AngryHorseException, self.mpd.albums, 'Gone')
+
+    def test_unchanged(self):
+        self.mpd.bands()
+        self.mpd.albums('Band 1')
+        self.mpd.save_snapshot()
+
+        mpd = SnapshotClient(self.rpc.host)
+        mpd.path = self.mpd.path
+        self.assertTrue(mpd.load_snapshot())
+        self.assertFalse(mpd.revalidate())
+        self.assertEqual(mpd.albums('Band 1'), ['Album 0', 'Album 1'])
+        mpd.jsonrpc.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import socket
+import threading
+import unittest
+
+from bench import fakempd
+from horsempdc.mpd.native import MPDProtocolError, NativeClient
+
+TRACKS = [
+    ('a/1.mp3', 'Band A', 'Album 1', 'Intro', 1),
+    ('a/2.mp3', 'Band A', 'Album 1', 'Intro', 2),
+    ('a/3.mp3', 'Band A', 'Album 1', None, 3),
+    ('a/4.mp3', 'Band A', 'Album 2', 'Outro', 1),
+    ('b/1.mp3', 'The B', 'Album "Q"', 'Song', 1),
+]
+
+
+class TestNativeClient(unittest.TestCase):
+    def setUp(self):
+        self.server = fakempd.start(TRACKS)
+        self.mpd = NativeClient(self.server.host, timeout=5)
+
+    def tearDown(self):
+        self.mpd.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connect(self):
+        self.mpd.connect()
+        self.assertIsNotNone(self.mpd.sock)
+
+    def test_bad_greeting(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+
+        mpd = NativeClient('%s:%d' % listener.getsockname(), timeout=5)
+        self.addCleanup(mpd.close)
+
+        def greet():
+            conn, _ = listener.accept()
+            conn.sendall('HTTP/1.1 400 Bad Request\n')
+            conn.close()
+
+        t = threading.Thread(target=greet)
+        t.start()
+        self.assertRaises(MPDProtocolError, mpd.connect)
+        t.join()
+
+    def test_command(self):
+        self.assertEqual(self.mpd.execute([('list', 'albumartist')]),
+                         [[('AlbumArtist', 'Band A'),
+                           ('AlbumArtist', 'The B')]])
+
+    def test_command_list(self):
+        self.assertEqual(self.mpd.bands(), ['Band A', 'The B'])
+        del self.server.received[:]
+
+        self.mpd.albums_many(['Band A', 'The B'])
+        self.assertEqual(self.server.received, [
+            'command_list_ok_begin',
+            'list "album" "albumartist" "Band A"',
+            'list "album" "albumartist" "The B"',
+            'command_list_end',
+        ])
+        self.assertEqual(self.mpd.albums('Band A'), ['Album 1', 'Album 2'])
+        self.assertEqual(self.mpd.albums('The B'), ['Album "Q"'])
+
+    def test_batches(self):
+        self.mpd.BATCH_SIZE = 2
+        ret = self.mpd.execute([('find', 'file', 'a/%d.mp3' % idx)
+                                for idx in xrange(1, 5)])
+        self.assertEqual([pairs[0] for pairs in ret],
+                         [('file', 'a/%d.mp3' % idx) for idx in xrange(1, 5)])
+        self.assertEqual(self.server.received.count('command_list_end'), 2)
+
+    def test_ack(self):
+        with self.assertRaises(MPDProtocolError) as cm:
+            self.mpd.execute([('list', 'albumartist'), ('bogus', 'arg')])
+        self.assertIn('unknown command', cm.exception.message)
+
+        # The connection is still usable afterwards.
+        self.assertEqual(len(self.mpd.execute([('list', 'albumartist')])), 1)
+
+    def test_reconnect(self):
+        self.mpd.connect()
+        self.server.drop = 1
+
+        self.assertEqual(self.mpd.bands(), ['Band A', 'The B'])
+        self.assertEqual(self.server.received.count('list "albumartist"'), 2)
+
+    def test_reconnect_once(self):
+        self.server.drop = 2
+        self.assertRaises(socket.error, self.mpd.execute,
+                          [('list', 'albumartist')])
+        self.assertIsNone(self.mpd.sock)
+
+    def test_tracks(self):
+        self.mpd.bands()
+        self.mpd.albums('Band A')
+
+        # Tracks without a title are shown by their file, and tracks with
+        # the same title are all kept.
+        self.assertEqual(self.mpd.tracks('Band A', 'Album 1'),
+                         ('Intro', 'Intro', 'a/3.mp3'))
+        self.assertEqual(self.mpd.track_details('Band A', 'Album 1', 0, 3),
+                         [(1, 181), (2, 182), (3, 183)])
+
+    def test_lookup(self):
+        self.assertEqual(self.mpd.lookup(['a/4.mp3', 'b/1.mp3', 'x.mp3']), {
+            'a/4.mp3': (1, 181),
+            'b/1.mp3': (1, 181),
+        })
+
+    def test_invalidate(self):
+        def fetches():
+            return self.server.received.count('list "albumartist"')
+
+        self.mpd.bands()
+        self.assertFalse(self.mpd.bands_stale())
+
+        # Invalidated bands are fetched once more, after which they're no
+        # longer stale, as bands don't expire otherwise.
+        self.mpd.invalidate()
+        self.assertTrue(self.mpd.bands_stale())
+        self.assertEqual(self.mpd.bands(), ['Band A', 'The B'])
+        self.assertFalse(self.mpd.bands_stale())
+
+        self.mpd.bands()
+        self.assertEqual(fetches(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
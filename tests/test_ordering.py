@@ -0,0 +1,139 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import random
+import threading
+import unittest
+
+from horsempdc.ordering import SortedView, SortedViews, collate, collate_the
+
+
+class TestCollate(unittest.TestCase):
+    def test_the(self):
+        self.assertEqual(collate_the('The Band'), collate('Band'))
+        self.assertEqual(collate_the('the band'), collate('band'))
+        self.assertEqual(collate_the('Theatre'), collate('Theatre'))
+
+    def test_unicode(self):
+        self.assertEqual(collate(u'Band'), collate('Band'))
+        collate(u'B\xe4nd \u2603')
+
+
+class TestSortedView(unittest.TestCase):
+    def test_sorted(self):
+        names = ['c', 'a', 'd', 'b']
+        self.assertEqual(SortedView(collate, names).names, sorted(names))
+
+    def test_equal_keys(self):
+        view = SortedView(len, ['ccc', 'b', 'aa', 'a', 'bb'])
+        self.assertEqual(view.names, ['a', 'b', 'aa', 'bb', 'ccc'])
+
+        view.add('c')
+        view.add('ab')
+        self.assertEqual(view.names, ['a', 'b', 'c', 'aa', 'ab', 'bb', 'ccc'])
+
+    def test_add_remove(self):
+        names = ['name %d' % idx for idx in xrange(200)]
+        random.Random(1).shuffle(names)
+
+        view = SortedView(collate, names[:100])
+        for name in names[100:]:
+            view.add(name)
+        for name in names[:50]:
+            view.remove(name)
+
+        self.assertEqual(view.names, sorted(names[50:]))
+        self.assertEqual(view.keys, [collate(name) for name in view.names])
+
+    def test_update(self):
+        counts = {'a': 1, 'b': 2, 'c': 3}
+        view = SortedView(lambda name: -counts[name], counts)
+        self.assertEqual(view.names, ['c', 'b', 'a'])
+
+        counts['a'] = 4
+        view.update('a')
+        self.assertEqual(view.names, ['a', 'c', 'b'])
+
+        # Adding a name that is already there doesn't duplicate it.
+        view.add('b')
+        self.assertEqual(view.names, ['a', 'c', 'b'])
+
+
+class TestSortedViews(unittest.TestCase):
+    def setUp(self):
+        self.names = dict.fromkeys(['The C', 'B', 'A'])
+        self.views = SortedViews({
+            'alphabetical': collate,
+            'the': collate_the,
+        }, self.names)
+
+    def test_ordered(self):
+        self.assertEqual(self.views.ordered('alphabetical'),
+                         ['A', 'B', 'The C'])
+        self.assertEqual(self.views.ordered('the'), ['A', 'B', 'The C'])
+        self.assertRaises(KeyError, self.views.ordered, 'unknown')
+
+    def test_lazy(self):
+        self.assertEqual(self.views.views, {})
+        self.views.ordered('the')
+        self.assertEqual(list(self.views.views), ['the'])
+
+        # Views that haven't been built yet pick up new names once they're
+        # built, from the names themselves.
+        self.names['The 0'] = None
+        self.views.add('The 0')
+        self.assertEqual(self.views.ordered('the'),
+                         ['The 0', 'A', 'B', 'The C'])
+        self.assertEqual(self.views.ordered('alphabetical'),
+                         ['A', 'B', 'The 0', 'The C'])
+
+    def test_published(self):
+        ordered = self.views.ordered('alphabetical')
+        self.assertIs(self.views.ordered('alphabetical'), ordered)
+
+        self.views.add('D')
+        self.assertEqual(ordered, ['A', 'B', 'The C'])
+        self.assertEqual(self.views.ordered('alphabetical'),
+                         ['A', 'B', 'D', 'The C'])
+
+        self.views.remove('B')
+        self.assertEqual(self.views.ordered('alphabetical'),
+                         ['A', 'D', 'The C'])
+
+    def test_update_one_order(self):
+        played = {}
+        views = SortedViews({
+            'alphabetical': collate,
+            'played': lambda name: (-played.get(name, 0), collate(name)),
+        }, self.names)
+        alphabetical = views.ordered('alphabetical')
+        self.assertEqual(views.ordered('played'), ['A', 'B', 'The C'])
+
+        played['The C'] = 1
+        views.update('The C', 'played')
+        self.assertEqual(views.ordered('played'), ['The C', 'A', 'B'])
+        self.assertIs(views.ordered('alphabetical'), alphabetical)
+
+    def test_concurrent(self):
+        self.views.ordered('alphabetical')
+        self.views.ordered('the')
+
+        def add(offset):
+            for idx in xrange(offset, 1000, 4):
+                self.views.add('Band %04d' % idx)
+
+        threads = [threading.Thread(target=add, args=(offset,))
+                   for offset in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        expected = sorted(['A', 'B', 'The C'] +
+                          ['Band %04d' % idx for idx in xrange(1000)])
+        self.assertEqual(self.views.ordered('alphabetical'), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
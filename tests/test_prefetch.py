@@ -0,0 +1,66 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import threading
+import time
+import unittest
+
+from horsempdc.prefetch import AlbumPrefetcher
+
+
+class SlowDict(dict):
+    def __contains__(self, key):
+        # Gives other threads the chance to check the same band meanwhile.
+        time.sleep(0.001)
+        return dict.__contains__(self, key)
+
+
+class FakeMPD(object):
+    def __init__(self):
+        self._albums = SlowDict()
+        self.fetched = []
+        self.lock = threading.Lock()
+
+    def albums_many(self, bands):
+        with self.lock:
+            self.fetched.extend(bands)
+
+        # Long enough for the other worker to pick its bands meanwhile.
+        time.sleep(0.05)
+        for band in bands:
+            self._albums[band] = {}
+
+    def albums(self, band):
+        return self._albums[band]
+
+
+class TestAlbumPrefetcher(unittest.TestCase):
+    def test_concurrent_fetches(self):
+        mpd = FakeMPD()
+        prefetcher = AlbumPrefetcher(mpd, radius=2, workers=4)
+        prefetcher.wanted = ['a', 'b', 'c']
+
+        threads = [threading.Thread(target=prefetcher._fetch)
+                   for _ in xrange(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sorted(mpd.fetched), ['a', 'b', 'c'])
+        self.assertEqual(prefetcher.inflight, {})
+
+    def test_albums_waits_for_inflight(self):
+        mpd = FakeMPD()
+        prefetcher = AlbumPrefetcher(mpd)
+        prefetcher.prefetch(['a', 'b'], 0)
+
+        # Either served by the prefetch or fetched after it finished.
+        time.sleep(0.01)
+        self.assertEqual(prefetcher.albums('a'), {})
+        self.assertEqual(mpd.fetched.count('a'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import unittest
+
+from horsempdc.search import SearchIndex, fold
+
+LINES = [
+    u'The Beatles',
+    u'Mot\xf6rhead',
+    u'Bj\xf6rk',
+    u'Sigur R\xf3s',
+    u'Caf\xe9 Tacvba',
+    u'The Beach Boys',
+    'Mot\xc3\xb6rhead Tribute',
+]
+
+
+class TestFold(unittest.TestCase):
+    def test_fold(self):
+        self.assertEqual(fold(u'The Beatles'), u'the beatles')
+        self.assertEqual(fold(u'Mot\xf6rhead'), u'motorhead')
+        self.assertEqual(fold(u'Caf\xe9'), u'cafe')
+        self.assertEqual(fold(u'Cafe\u0301'), u'cafe')
+        self.assertEqual(fold(u'\u212b'), u'a')
+        self.assertEqual(fold('Bj\xc3\xb6rk'), u'bjork')
+
+    def test_non_latin(self):
+        self.assertEqual(fold(u'\u6c34 \u2660'), u'\u6c34 \u2660')
+        self.assertEqual(fold(u'\u041c\u0418\u0420'), u'\u043c\u0438\u0440')
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex(LINES)
+
+    def search(self, query):
+        return [LINES[idx] for idx in self.index.search(query)]
+
+    def test_empty(self):
+        self.assertEqual(self.index.search(u''), range(len(LINES)))
+        self.assertEqual(self.index.search(u'  '), range(len(LINES)))
+
+    def test_substring(self):
+        self.assertEqual(self.search(u'eatles'), [u'The Beatles'])
+        self.assertEqual(self.search(u'the bea'),
+                         [u'The Beatles', u'The Beach Boys'])
+        self.assertEqual(self.search(u'xyz'), [])
+
+    def test_diacritics(self):
+        self.assertEqual(self.search(u'MOTOR'), [LINES[1], LINES[6]])
+        self.assertEqual(self.search(u'mot\xf6r'), [LINES[1], LINES[6]])
+        self.assertEqual(self.search(u'bjork'), [u'Bj\xf6rk'])
+        self.assertEqual(self.search(u'ros'), [u'Sigur R\xf3s'])
+        self.assertEqual(self.search(u'e ta'), [u'Caf\xe9 Tacvba'])
+
+    def test_narrowing(self):
+        self.assertEqual(self.search(u'b'), [
+            LINES[0], LINES[2], LINES[4], LINES[5], LINES[6]])
+        self.assertEqual(self.search(u'be'), [LINES[0], LINES[5]])
+        self.assertEqual(self.search(u'bea'), [LINES[0], LINES[5]])
+        self.assertEqual(self.search(u'beat'), [LINES[0]])
+
+        # Removing characters isn't narrowing anything down.
+        self.assertEqual(self.search(u'bea'), [LINES[0], LINES[5]])
+        self.assertEqual(self.search(u'r'), [
+            LINES[1], LINES[2], LINES[3], LINES[6]])
+
+    def test_long_query(self):
+        lines = [u'The Best Of The Best Of The Best Of Band %d' % idx
+                 for idx in xrange(3)]
+        index = SearchIndex(lines)
+
+        # Queries only differing well after their start.
+        self.assertEqual(index.search(u'the best of the best of band 1'),
+                         [1])
+        self.assertEqual(index.search(u'the best of the best of band 4'), [])
+        self.assertEqual(index.search(lines[2].upper()), [2])
+
+    def test_many_matches(self):
+        lines = [u'Band %d' % idx for idx in xrange(100)]
+        index = SearchIndex(lines)
+        self.assertEqual(index.search(u'band'), range(100))
+        self.assertEqual(index.search(u'band 1'), [1] + range(10, 20))
+
+        index.last_query = None
+        self.assertEqual(index.search(u'5'), [5, 15, 25, 35, 45] +
+                         range(50, 60) + [65, 75, 85, 95])
+
+    def test_appended(self):
+        lines = list(LINES)
+        index = SearchIndex(lines)
+        self.assertEqual(index.search(u'beat'), [0])
+
+        lines.append(u'Beat Happening')
+        self.assertEqual(index.search(u'beat'), [0, 7])
+        self.assertEqual(index.search(u'happ'), [7])
+
+    def test_separator(self):
+        index = SearchIndex([u'A\x00B', u'C'])
+        self.assertEqual(index.search(u'b'), [0])
+        self.assertEqual(index.search(u'c'), [1])
+        self.assertEqual(index.search(u'a\x00b'), [])
+
+    def test_background(self):
+        lines = [u'Band %d' % idx for idx in xrange(SearchIndex.BACKGROUND)]
+        index = SearchIndex(lines)
+        index.start()
+        self.assertEqual(index.search(u'band 999'), [999])
+
+
+if __name__ == '__main__':
+    unittest.main()
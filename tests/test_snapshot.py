@@ -0,0 +1,87 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from horsempdc import snapshot
+from horsempdc.snapshot import Snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.path = os.path.join(self.dirpath, 'snapshot')
+        self.snapshots = []
+
+    def tearDown(self):
+        for s in self.snapshots:
+            s.close()
+        shutil.rmtree(self.dirpath)
+
+    def load(self):
+        s = Snapshot.load(self.path)
+        if s is not None:
+            self.snapshots.append(s)
+        return s
+
+    def test_roundtrip(self):
+        bands = [(u'Band', u'local:artist:band'),
+                 (u'Mot\xf6rhead', u'local:artist:m%C3%B6torhead'),
+                 (u'Unbrowsed', u'local:artist:unbrowsed'),
+                 (u'Empty', u'local:artist:empty')]
+        albums = {
+            u'Band': [(u'First', u'local:album:first'),
+                      (u'Second', u'local:album:second')],
+            u'Mot\xf6rhead': [(u'Ace of \u2660', u'local:album:ace')],
+            u'Empty': [],
+        }
+        Snapshot.write(self.path, bands, albums)
+
+        s = self.load()
+        self.assertEqual(list(s.bands()), [
+            (idx, name, uri) for idx, (name, uri) in enumerate(bands)])
+        self.assertEqual(s.albums(0), albums[u'Band'])
+        self.assertEqual(s.albums(1), albums[u'Mot\xf6rhead'])
+        self.assertIsNone(s.albums(2))
+        self.assertEqual(s.albums(3), [])
+
+    def test_no_bands(self):
+        Snapshot.write(self.path, [], {})
+        self.assertEqual(list(self.load().bands()), [])
+
+    def test_long_string(self):
+        name = u'x' * 0x12345
+        Snapshot.write(self.path, [(name, u'local:artist:x')],
+                       {name: [(u'y' * 0x10000, u'local:album:y')]})
+
+        s = self.load()
+        self.assertEqual(list(s.bands()), [(0, name, u'local:artist:x')])
+        self.assertEqual(s.albums(0), [(u'y' * 0x10000, u'local:album:y')])
+
+    def test_missing(self):
+        self.assertIsNone(self.load())
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        self.assertIsNone(self.load())
+
+    def test_truncated(self):
+        with open(self.path, 'wb') as f:
+            f.write(snapshot.MAGIC)
+        self.assertIsNone(self.load())
+
+    def test_bad_magic(self):
+        with open(self.path, 'wb') as f:
+            f.write(struct.pack('<4sIII', 'NOPE', snapshot.VERSION, 0, 0))
+        self.assertIsNone(self.load())
+
+    def test_bad_version(self):
+        with open(self.path, 'wb') as f:
+            f.write(struct.pack('<4sIII', snapshot.MAGIC,
+                                snapshot.VERSION + 1, 0, 0))
+        self.assertIsNone(self.load())
@@ -0,0 +1,110 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import unittest
+
+from bench import fakews
+from horsempdc.websocket import WebSocket, WebSocketException
+from horsempdc.websocket import OP_CLOSE, OP_PING, OP_PONG, OP_TEXT
+
+
+class TestWebSocket(unittest.TestCase):
+    def setUp(self):
+        self.server = fakews.start()
+        self.ws = WebSocket(self.server.url, timeout=5)
+
+    def tearDown(self):
+        self.ws.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def connect(self):
+        self.ws.connect()
+        self.conn = self.server.accept()
+        self.addCleanup(self.conn.close)
+        return self.conn
+
+    def test_handshake(self):
+        conn = self.connect()
+        self.assertEqual(conn.path, '/mopidy/ws')
+        self.assertEqual(conn.headers['upgrade'], 'websocket')
+        self.assertEqual(conn.headers['sec-websocket-version'], '13')
+
+    def test_handshake_rejected(self):
+        self.server.status = 400
+        self.assertRaises(WebSocketException, self.ws.connect)
+
+    def test_handshake_bad_accept(self):
+        self.server.bad_accept = True
+        self.assertRaises(WebSocketException, self.ws.connect)
+
+    def test_unsupported_scheme(self):
+        ws = WebSocket('wss://127.0.0.1/')
+        self.assertRaises(WebSocketException, ws.connect)
+
+    def test_send_masked(self):
+        conn = self.connect()
+        for text in (u'h\xe9llo', 'a' * 200, 'b' * 70000):
+            self.ws.send(text)
+            fin, opcode, payload, masked = conn.recv_frame()
+            self.assertTrue(fin)
+            self.assertTrue(masked)
+            self.assertEqual(opcode, OP_TEXT)
+            if isinstance(text, unicode):
+                text = text.encode('utf8')
+            self.assertEqual(payload, text)
+
+    def test_recv(self):
+        conn = self.connect()
+        for text in ('{"event": "x"}', 'a' * 200, 'b' * 70000):
+            conn.send(text)
+            self.assertEqual(self.ws.recv(), text)
+
+    def test_recv_fragmented(self):
+        conn = self.connect()
+        conn.send('abcdefgh', fragments=3)
+        self.assertEqual(self.ws.recv(), 'abcdefgh')
+
+    def test_ping(self):
+        conn = self.connect()
+        conn.send_frame(OP_PING, 'hi')
+        conn.send('message')
+        self.assertEqual(self.ws.recv(), 'message')
+        self.assertEqual(conn.recv_frame(), (True, OP_PONG, 'hi', True))
+
+    def test_ping_between_fragments(self):
+        conn = self.connect()
+        conn.send_frame(OP_TEXT, 'ab', fin=False)
+        conn.send_frame(OP_PING, '')
+        conn.send_frame(0, 'cd')
+        self.assertEqual(self.ws.recv(), 'abcd')
+        self.assertEqual(conn.recv_frame(), (True, OP_PONG, '', True))
+
+    def test_pong_ignored(self):
+        conn = self.connect()
+        conn.send_frame(OP_PONG, '')
+        conn.send('message')
+        self.assertEqual(self.ws.recv(), 'message')
+
+    def test_close_by_server(self):
+        conn = self.connect()
+        conn.send_frame(OP_CLOSE, '')
+        self.assertIsNone(self.ws.recv())
+        self.assertIsNone(self.ws.sock)
+        self.assertEqual(conn.recv_frame(), (True, OP_CLOSE, '', True))
+
+    def test_close_by_client(self):
+        conn = self.connect()
+        self.ws.close()
+        self.assertIsNone(self.ws.sock)
+        self.assertEqual(conn.recv_frame(), (True, OP_CLOSE, '', True))
+
+    def test_connection_lost(self):
+        conn = self.connect()
+        conn.close()
+        self.assertRaises(WebSocketException, self.ws.recv)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# Copyright (C) 2014 Jurriaan Bremer.
+# This file is part of HorseMPDC - http://www.horsempdc.org/.
+# See the file 'docs/LICENSE.txt' for copying permission.
+
+import threading
+import time
+import unittest
+
+from horsempdc.workers import SingleFlight, WorkerPool
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow(self, value):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def run_concurrently(self, key, value, count):
+        results = []
+
+        def run():
+            try:
+                results.append(self.flights.run(key, self.slow, value))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=run)]
+        threads[0].start()
+        self.started.wait(5)
+
+        for _ in xrange(count - 1):
+            threads.append(threading.Thread(target=run))
+            threads[-1].start()
+
+        # All the others have joined the first call once it's counted.
+        while self.flights.coalesced < count - 1:
+            time.sleep(0.001)
+
+        self.release.set()
+        for t in threads:
+            t.join(5)
+        return results
+
+    def test_coalesced(self):
+        results = self.run_concurrently('key', 42, 4)
+        self.assertEqual(results, [42] * 4)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flights.coalesced, 3)
+        self.assertEqual(self.flights.jobs, {})
+
+    def test_error_shared(self):
+        error = ValueError('failed')
+        results = self.run_concurrently('key', error, 3)
+        self.assertEqual(results, [error] * 3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flights.jobs, {})
+
+    def test_sequential(self):
+        self.release.set()
+        self.assertEqual(self.flights.run('key', self.slow, 1), 1)
+        self.assertEqual(self.flights.run('key', self.slow, 2), 2)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.flights.coalesced, 0)
+
+    def test_join(self):
+        job, leader = self.flights.join('key')
+        self.assertTrue(leader)
+
+        other, leader = self.flights.join('key')
+        self.assertIs(other, job)
+        self.assertFalse(leader)
+
+        self.flights.finish('key', job, 'result')
+        self.assertEqual(other.wait(), 'result')
+        self.assertTrue(self.flights.join('key')[1])
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(4)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_map(self):
+        self.assertEqual(self.pool.map(lambda x: x * 2, xrange(100)),
+                         range(0, 200, 2))
+
+    def test_submit(self):
+        job = self.pool.submit(lambda a, b: a + b, 1, b=2)
+        self.assertEqual(job.wait(5), 3)
+
+    def test_error(self):
+        def fail():
+            raise ValueError('failed')
+
+        self.assertRaises(ValueError, self.pool.submit(fail).wait, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()